@@ -0,0 +1,97 @@
+import os
+
+# "hardware" on the Pi; "fake" runs everything against the stand-ins in fakes.py
+BACKEND = os.environ.get("MIDIPLAYER_BACKEND", "hardware")
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+BLUETOOTHCTL = "bluetoothctl"
+
+def Synth(**settings):
+    import fluidsynth
+    return fluidsynth.Synth(**settings)
+
+# C functions that pyfluidsynth has no wrapper for: argument types after the synth pointer
+NATIVE_SYNTH_FUNCTIONS = {
+    "key_pressure": ("c_int", "c_int", "c_int"),
+    "channel_pressure": ("c_int", "c_int"),
+    "sysex": ("c_char_p", "c_int", "c_void_p", "c_void_p", "c_void_p", "c_int"),
+    "get_cpu_load": (),
+}
+NATIVE_RESULT_TYPES = {"get_cpu_load": "c_double"}  # the rest return int
+
+def synth_method(synth, name):
+    """
+    `synth.name`, or a call straight into libfluidsynth's fluid_synth_<name>
+    when the Python wrapper lacks it. None if neither exists.
+    """
+    method = getattr(synth, name, None)
+    if method is not None or name not in NATIVE_SYNTH_FUNCTIONS:
+        return method
+    import ctypes, functools, fluidsynth
+    function = getattr(fluidsynth._fl, "fluid_synth_" + name, None)
+    if function is None:
+        return None
+    function.argtypes = [ctypes.c_void_p] + [getattr(ctypes, t) for t in NATIVE_SYNTH_FUNCTIONS[name]]
+    function.restype = getattr(ctypes, NATIVE_RESULT_TYPES.get(name, "c_int"))
+    if name == "sysex":
+        # no response buffer, not a dry run
+        return lambda data: function(synth.synth, data, len(data), None, None, None, 0)
+    return functools.partial(function, synth.synth)
+
+def MidiIn():
+    import rtmidi
+    return rtmidi.MidiIn()
+
+def MidiOut():
+    import rtmidi
+    return rtmidi.MidiOut()
+
+def audio_command(path):
+    """Command line that plays the WAV file at `path`."""
+    return ["aplay", "-q", path]
+
+def Button(pin, hold_time=1, hold_repeat=False):
+    import gpiozero
+    return gpiozero.Button(pin, hold_time=hold_time, hold_repeat=hold_repeat)
+
+def Display(display_type):
+    """Create and start the ST7789 panel. Returns (display, rotation)."""
+    import st7789
+    if display_type in ("square", "rect", "round"):
+        rotation = 0 if display_type == "rect" else 90
+        disp = st7789.ST7789(
+            height=135 if display_type == "rect" else 240,
+            rotation=rotation,
+            port=0,
+            cs=st7789.BG_SPI_CS_FRONT,
+            dc=9,
+            backlight=13,
+            spi_speed_hz=80 * 1000 * 1000,
+            offset_left=0 if display_type == "square" else 40,
+            offset_top=53 if display_type == "rect" else 0,
+        )
+    elif display_type == "dhmini":
+        rotation = 180
+        disp = st7789.ST7789(
+            height=240,
+            width=320,
+            rotation=rotation,
+            port=0,
+            cs=1,
+            dc=9,
+            backlight=13,
+            spi_speed_hz=60 * 1000 * 1000,
+            offset_left=0,
+            offset_top=0,
+        )
+    else:
+        raise ValueError(f"Invalid display type {display_type!r}")
+    disp.begin()
+    return disp, rotation
+
+def load_font(size):
+    from PIL import ImageFont
+    return ImageFont.truetype(FONT_PATH, size)
+
+if BACKEND == "fake":
+    from fakes import Synth, MidiIn, MidiOut, audio_command, Button, Display, load_font, BLUETOOTHCTL
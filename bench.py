@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the player's hot paths, run against the stand-ins in fakes.py
+so they work on any Linux box:
+
+    python3 bench.py                 # everything
+    python3 bench.py input render    # just some of them
+
+input     midi_callback dispatch time per message
+thru      live input to an external port through a transposing route
+playback  file playback lateness (jitter) and end-of-file drift
+playlist  gap between files of a queue, against starting each file by hand
+menu      library indexing and MIDI FILE menu open time for a large library
+render    menu frame render time and bytes pushed to the panel
+events    MIDI file load time and memory, mido against the event cache
+offline   MIDI files rendered to audio per second of music, across all cores
+governor  synth load governor stages through an overload, and the cost of a check
+soundfont SoundFont memory held for a file, whole font against only the presets it plays
+control   control socket round trip, and live input while a monitor polls metrics
+record    live input callback time with and without recording, and the recorded file
+scroll    presses and hold time to reach a deep MIDI FILE entry, and the cost of a step there
+bluetooth discovery, connect and reconnect of a BLE-MIDI device through fakebluetoothctl.py, also after a restart
+"""
+import os, sys, shutil, socket, struct, tempfile, threading, time, tracemalloc
+
+os.environ["MIDIPLAYER_BACKEND"] = "fake"
+workdir = tempfile.mkdtemp(prefix="midiplayer-bench-")
+os.environ["HOME"] = workdir  # keeps the library and caches out of the real home
+
+import mido
+import midiplayer, fakes, offline, playback, display, governor, soundfonts, control, bluetooth, library as midilibrary
+
+def summary(samples, scale=1e6):
+    """p50 / p99 / max of a list of seconds, in microseconds by default."""
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale
+    return f"p50 {pick(0.5):9.1f}  p99 {pick(0.99):9.1f}  max {ordered[-1] * scale:9.1f}"
+
+def chunk(ckid, data):
+    return ckid + struct.pack("<I", len(data)) + data + (b"\0" if len(data) & 1 else b"")
+
+def make_soundfont(path, sample_frames=0):
+    """
+    A GM-sized SoundFont for the catalog and the fake synth: 128 programs and
+    a drum kit, each preset with one instrument playing one silent sample of
+    `sample_frames` frames.
+    """
+    presets = [(0, program, f"Program {program}") for program in range(128)] + [(128, 0, "Drums")]
+    n = len(presets)
+    terminal_mod = bytes(10)
+    phdr = b"".join(struct.pack("<20sHHHIII", name.encode(), program, bank, i, 0, 0, 0) for i, (bank, program, name) in enumerate(presets))
+    phdr += struct.pack("<20sHHHIII", b"EOP", 0, 0, n, 0, 0, 0)
+    bags = b"".join(struct.pack("<HH", i, 0) for i in range(n + 1))
+    pgen = b"".join(struct.pack("<HH", 41, i) for i in range(n)) + bytes(4)   # instrument i
+    inst = b"".join(struct.pack("<20sH", f"Instrument {i}".encode(), i) for i in range(n)) + struct.pack("<20sH", b"EOI", n)
+    igen = b"".join(struct.pack("<HH", 53, i) for i in range(n)) + bytes(4)   # sample i
+    shdr = b"".join(struct.pack("<20sIIIIIBbHH", f"Sample {i}".encode(), i * sample_frames, (i + 1) * sample_frames,
+                                i * sample_frames, (i + 1) * sample_frames, 44100, 60, 0, 0, 1) for i in range(n))
+    shdr += struct.pack("<20sIIIIIBbHH", b"EOS", 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    body = b"sfbk" + chunk(b"LIST", b"INFO" + chunk(b"ifil", b"\2\0\1\0"))
+    body += chunk(b"LIST", b"sdta" + chunk(b"smpl", bytes(2 * n * sample_frames)))
+    body += chunk(b"LIST", b"pdta" + chunk(b"phdr", phdr) + chunk(b"pbag", bags) + chunk(b"pmod", terminal_mod)
+                  + chunk(b"pgen", pgen) + chunk(b"inst", inst) + chunk(b"ibag", bags) + chunk(b"imod", terminal_mod)
+                  + chunk(b"igen", igen) + chunk(b"shdr", shdr))
+    with open(path, "wb") as f:
+        f.write(chunk(b"RIFF", body))
+
+def make_midi_file(path, seconds, notes_per_second=40, tracks=4):
+    mid = mido.MidiFile(ticks_per_beat=480)
+    ticks_per_note = int(480 * 2 / notes_per_second * tracks)  # 120 BPM = 2 beats per second
+    for track_no in range(tracks):
+        track = mido.MidiTrack()
+        channel = track_no % 16
+        track.append(mido.Message("program_change", channel=channel, program=track_no))
+        for i in range(int(seconds * notes_per_second / tracks)):
+            note = 48 + (i * 7 + track_no) % 36
+            track.append(mido.Message("note_on", channel=channel, note=note, velocity=90, time=0 if i == 0 else ticks_per_note // 2))
+            track.append(mido.Message("control_change", channel=channel, control=1, value=i % 128, time=0))
+            track.append(mido.Message("note_off", channel=channel, note=note, velocity=0, time=ticks_per_note // 2))
+        mid.tracks.append(track)
+    mid.save(path)
+
+def start_synth():
+    if midiplayer.soundfont_pool is None:
+        midiplayer.soundfontname = os.path.join(workdir, "bench.sf2")
+        make_soundfont(midiplayer.soundfontname)
+        midiplayer.start_synth(lambda text: None)
+
+def bench_input(count=20000):
+    start_synth()
+    midiplayer.port_watcher.poll()  # the merger opens every input it sees
+    live_input = midiplayer.live_input
+    midi_router = midiplayer.midi_router
+    # a dense mod wheel stream with notes, pressure, bends and a running-status packet in it
+    messages = [[0x90, 60, 100], [0xB0, 1, 64], [0xB0, 1, 65], [0xD0, 30], [0xB0, 1, 66],
+                [0xE0, 0, 64], [0xA0, 60, 20], [0xB0, 1, 67, 1, 68], [0x80, 60, 0], [0xC0, 5]]
+    samples = []
+    clock = time.perf_counter
+    live_input.reset_stats()
+    midi_router.latency.reset()
+    for i in range(count):
+        message = messages[i % len(messages)]
+        start = clock()
+        fakes.send_input(fakes.virtual_inputs[0], message)
+        samples.append(clock() - start)
+    print(f"input     callback (us)             {summary(samples)}")
+    print(f"input     {midi_router.latency.report()}")
+    live_input.reset_stats()
+    for message in ([0x90], [0xB0, 7], [0xE0, 1], [], [0xF0, 0x7E, 0x7F, 0x09, 0x01, 0xF7]):
+        midiplayer.midi_callback((message, 0.0), None)
+    print(f"input     short messages            {live_input.ignored} of 3 ignored, no exceptions")
+
+def bench_thru(count=20000):
+    start_synth()
+    midiplayer.port_watcher.poll()
+    midi_router = midiplayer.midi_router
+    output = fakes.virtual_outputs[0]
+    midi_router.configured.append(midiplayer.router.Route(midiplayer.ports.port_key(output), channels=[1], transpose=12, velocity="soft"))
+    midi_router.sync()
+    messages = [[0x90, 60, 100], [0xB0, 1, 64], [0x91, 62, 90], [0x80, 60, 0]]
+    received = fakes.sent[output]
+    received.clear()
+    samples = []
+    clock = time.perf_counter
+    for i in range(count):
+        start = clock()
+        fakes.send_input(fakes.virtual_inputs[0], messages[i % len(messages)])
+        samples.append(received[-1][0] - start)
+    print(f"thru      input to port (us)        {summary(samples)}")
+    print(f"thru      {len(received)} of {count} forwarded (channel 2 filtered), last {received[-1][1]}")
+
+def bench_playback(seconds=10):
+    start_synth()
+    path = os.path.join(workdir, "playback.mid")
+    make_midi_file(path, seconds)
+    times, _messages = playback.load_events(path)
+    received = []
+    player = playback.Player(playback.EventCache(os.path.join(workdir, "events")))
+    player.play(path, lambda message: received.append(time.perf_counter()))
+    while player.is_playing():
+        time.sleep(0.05)
+    # all_notes_off adds no sends on a normal finish, so sends line up with events
+    origin = received[0] - times[0]
+    lateness = [r - (origin + t) for r, t in zip(received, times)]
+    print(f"playback  lateness (us)             {summary([abs(l) for l in lateness])}")
+    print(f"playback  end-of-file drift         {lateness[-1] * 1e3:9.3f} ms over {times[-1]:.1f} s, {len(times)} events")
+
+def bench_playlist(count=3, seconds=3):
+    start_synth()
+    paths = []
+    for i in range(count):
+        paths.append(os.path.join(workdir, f"queue{i}.mid"))
+        make_midi_file(paths[-1], seconds, notes_per_second=40 + 20 * i)
+    # the note ons of the queue on one timeline, each file starting where the one before ended
+    expected = []
+    offset = 0.0
+    firsts = []
+    for path in paths:
+        times, messages = playback.load_events(path)
+        ons = [offset + t for t, m in zip(times, messages) if m[0] & 0xF0 == 0x90 and m[2]]
+        firsts.append(len(expected))
+        expected += ons
+        offset += times[-1]
+    player = playback.Player(playback.EventCache(os.path.join(workdir, "queue-events")))
+    received = []
+    def send(message):
+        if message[0] & 0xF0 == 0x90 and message[2]:
+            received.append(time.perf_counter())
+    start = time.perf_counter()
+    player.play(paths[0], send, following=paths[1:])
+    while player.is_playing():
+        time.sleep(0.05)
+    by_hand = received[0] - start  # first file from scratch: parsed and cached on the way
+    origin = received[0] - expected[0]
+    lateness = [r - (origin + e) for r, e in zip(received, expected)]
+    gaps = [lateness[i] for i in firsts[1:]]
+    print(f"playlist  start by hand (first note)  {by_hand * 1e3:9.3f} ms, uncached")
+    print(f"playlist  gap at file changes (us)  {', '.join(f'{g * 1e6:.1f}' for g in gaps)}  "
+          f"({len(received)} of {len(expected)} notes, all files {summary([abs(l) for l in lateness])})")
+
+def bench_menu(count=3000):
+    root = os.path.join(workdir, "midifiles")
+    template = os.path.join(workdir, "template.mid")
+    make_midi_file(template, 1, tracks=1)
+    for i in range(count):
+        folder = os.path.join(root, f"folder{i // 100:02d}")
+        os.makedirs(folder, exist_ok=True)
+        shutil.copy(template, os.path.join(folder, f"song_{i:05d}.mid"))
+    index_path = os.path.join(workdir, "bench-library.json")
+    lib = midilibrary.Library(root, index_path)
+    start = time.perf_counter()
+    lib.refresh()
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    lib._read_missing_metadata()
+    lib._rebuild_listing()
+    lib.save()
+    metadata = time.perf_counter() - start
+    warm = midilibrary.Library(root, index_path)
+    start = time.perf_counter()
+    warm.load()
+    warm.refresh()
+    reload = time.perf_counter() - start
+    midiplayer.library = warm
+    disp, rotation = fakes.Display("square")
+    midiplayer.renderer = display.Renderer(disp, fakes.load_font(20), rotation)
+    samples = []
+    for _ in range(200):
+        start = time.perf_counter()
+        midiplayer.open_midi_files()
+        samples.append(time.perf_counter() - start)
+    print(f"menu      first index of {count} files  {scan * 1e3:9.1f} ms (+{metadata * 1e3:.0f} ms metadata)")
+    print(f"menu      index reload at startup   {reload * 1e3:9.1f} ms")
+    print(f"menu      MIDI FILE open (us)       {summary(samples)}")
+
+def bench_render(frames=60):
+    disp, rotation = fakes.Display("square")
+    renderer = display.Renderer(disp, fakes.load_font(20), rotation)
+    lines = [f"Song number {i}" for i in range(frames)]
+    for label in ("cold", "warm"):
+        samples = []
+        sent = disp.bytes_sent
+        for selected in range(frames):
+            start = time.perf_counter()
+            with renderer._spi:
+                renderer._frame(lines, selected)
+            samples.append(time.perf_counter() - start)
+        per_frame = (disp.bytes_sent - sent) / frames
+        print(f"render    {label} frame (us)           {summary(samples)}  {per_frame / 1024:.1f} KiB/frame")
+
+def bench_events(seconds=300):
+    path = os.path.join(workdir, "events.mid")
+    make_midi_file(path, seconds, notes_per_second=160, tracks=16)
+    cache = playback.EventCache(os.path.join(workdir, "events"))
+    cache.load(path)  # build the cache file
+    for label, load in (("mido", playback.load_events), ("cache", cache.load)):
+        start = time.perf_counter()
+        times, messages = load(path)
+        took = time.perf_counter() - start
+        del times, messages
+        tracemalloc.start()  # slows the loading down, so timed on its own
+        times, messages = load(path)
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        walk = time.perf_counter()
+        for i in range(len(times)):
+            times[i], messages[i]
+        walk = time.perf_counter() - walk
+        print(f"events    {label:<5} load {took * 1e3:9.2f} ms  {allocated / 1024:9.0f} KiB held  "
+              f"walk {walk * 1e3:6.1f} ms  ({len(times)} events)")
+        del times, messages
+
+def bench_offline(count=8, seconds=30):
+    start_synth()
+    paths = []
+    for i in range(count):
+        paths.append(os.path.join(workdir, f"offline{i}.mid"))
+        make_midi_file(paths[-1], seconds)
+    cache = offline.RenderCache(os.path.join(workdir, "renders"), midiplayer.soundfont_catalog.cache_path, 1 << 30)
+    start = time.perf_counter()
+    futures = [cache.render(path, midiplayer.soundfontname, midiplayer.render_settings()) for path in paths]
+    for future in futures:
+        future.result()
+    took = time.perf_counter() - start
+    hits = sum(cache.lookup(path, midiplayer.soundfontname, midiplayer.render_settings()) is not None for path in paths)
+    print(f"offline   {count} x {seconds} s on {cache.workers} workers  {took:9.2f} s, "
+          f"{count * seconds / took:.1f}x realtime, {hits} cached")
+
+def bench_governor():
+    start_synth()
+    synth = midiplayer.fs
+    gov = midiplayer.synth_governor
+    # a dense passage: load climbs past the limit, stays there a while, then drops off
+    loads = [30] * 4 + [60, 80, 90, 95, 95, 85, 70] + [50] * 4 + [20] * 40
+    stages = []
+    samples = []
+    worst = {}
+    for load in loads:
+        synth.cpu_load = float(load)
+        start = time.perf_counter()
+        with gov._lock:
+            gov.check()
+        samples.append(time.perf_counter() - start)
+        if not stages or gov.stage > max(stages):
+            worst = dict(synth.settings)
+        stages.append(gov.stage)
+    print(f"governor  stages {''.join(map(str, stages))}")
+    print(f"governor  at the worst: polyphony {worst['synth.polyphony']}, reverb {worst['synth.reverb.active']}, "
+          f"chorus {worst['synth.chorus.active']}, released voices {worst['synth.overflow.released']:.0f}; "
+          f"back to polyphony {synth.settings['synth.polyphony']}")
+    print(f"governor  check (us)                {summary(samples)}")
+
+def bench_soundfont(sample_frames=64 * 1024):
+    path = os.path.join(workdir, "large.sf2")
+    make_soundfont(path, sample_frames)
+    midi = os.path.join(workdir, "presets.mid")
+    make_midi_file(midi, 60, tracks=6)
+    catalog = soundfonts.Catalog(os.path.join(workdir, "bench-soundfonts.json"))
+    start = time.perf_counter()
+    catalog.presets(path)
+    parsed = time.perf_counter() - start
+    cache = playback.EventCache(os.path.join(workdir, "events"))
+    cache.load(midi)
+    _times, messages = cache.load(midi)  # mapped from the cache, as when a file is played again
+    mib = 1024 * 1024
+    for dynamic in (False, True):
+        pool = soundfonts.SoundFontPool(fakes.Synth(), catalog, 1 << 30, dynamic)
+        pool.select(path)
+        start = time.perf_counter()
+        used = soundfonts.presets_used(messages)
+        pool.preload(used)
+        took = time.perf_counter() - start
+        label = "presets" if dynamic else "whole"
+        print(f"soundfont {label:<7} {pool.used() / mib:7.1f} MiB held of {os.path.getsize(path) / mib:.1f} MiB, "
+              f"{len(used)} presets played, preload {took * 1e3:.2f} ms")
+    print(f"soundfont catalog parse with preset sizes  {parsed * 1e3:9.1f} ms")
+
+def bench_control(count=20000, polls_per_second=100):
+    start_synth()
+    midiplayer.port_watcher.poll()
+    server = control.ControlServer(os.path.join(workdir, "control.sock"), midiplayer.handle_control)
+    server.start()
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(server.path)
+    stream = connection.makefile("rwb")
+    def ask(request):
+        stream.write(request)
+        stream.flush()
+        return stream.readline()
+    samples = []
+    for _ in range(500):
+        start = time.perf_counter()
+        ask(b'{"cmd":"metrics"}\n')
+        samples.append(time.perf_counter() - start)
+    size = len(ask(b"metrics\n"))
+    print(f"control   metrics round trip (us)   {summary(samples)}, {size} bytes")
+    def input_times():
+        samples = []
+        clock = time.perf_counter
+        for i in range(count):
+            start = clock()
+            fakes.send_input(fakes.virtual_inputs[0], [0x90 | (i & 1) << 4, 60, 100])
+            samples.append(clock() - start)
+        return samples
+    quiet = input_times()
+    polling = True
+    def monitor():
+        while polling:
+            ask(b"metrics\n")
+            time.sleep(1 / polls_per_second)
+    thread = threading.Thread(target=monitor)
+    thread.start()
+    polled = input_times()
+    polling = False
+    thread.join()
+    print(f"control   input, nobody polling     {summary(quiet)}")
+    print(f"control   input, {polls_per_second} polls/s       {summary(polled)}")
+
+def bench_record(count=10000):
+    start_synth()
+    midiplayer.port_watcher.poll()
+    midi_router = midiplayer.midi_router
+    recorder = midiplayer.recorder
+    saved = []
+    recorder.on_saved = saved.append
+    messages = [[0x90, 60, 100], [0xB0, 1, 64], [0xE0, 0, 64], [0x80, 60, 0], [0xB0, 1, 65, 1, 66]]
+    # every other message goes past the recorder, so both sets see the same noise
+    samples = ([], [])
+    clock = time.perf_counter
+    midiplayer.start_recording()
+    for i in range(2 * count):
+        midi_router.tap = recorder.record if i & 1 else None
+        start = clock()
+        fakes.send_input(fakes.virtual_inputs[0], messages[i // 2 % len(messages)])
+        samples[i & 1].append(clock() - start)
+        if i % 1000 == 999:
+            time.sleep(0.01)  # a dense passage, not a flood: the ring is drained in between
+    midiplayer.stop_recording()
+    recorder._thread.join()
+    print(f"record    input, not recording (us) {summary(samples[0])}")
+    print(f"record    input, recording (us)     {summary(samples[1])}")
+    notes = sum(1 for message in mido.MidiFile(saved[0]) if message.type == "note_on")
+    print(f"record    {recorder.events} messages saved, {recorder.dropped} dropped, {notes} of {count // len(messages)} note ons, "
+          f"{os.path.getsize(saved[0])} bytes")
+
+def bench_scroll(count=3000, target=2000):
+    root = os.path.join(workdir, "scrollfiles")
+    template = os.path.join(workdir, "template.mid")
+    make_midi_file(template, 1, tracks=1)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    for i in range(count):
+        folder = os.path.join(root, f"folder{i // 100:02d}")
+        os.makedirs(folder, exist_ok=True)
+        shutil.copy(template, os.path.join(folder, f"{letters[i * 7 % 26]}_tune_{i:05d}.mid"))
+    lib = midilibrary.Library(root, os.path.join(workdir, "scroll-library.json"))
+    lib.refresh()
+    midiplayer.library = lib
+    disp, rotation = fakes.Display("square")
+    midiplayer.renderer = renderer = display.Renderer(disp, fakes.load_font(20), rotation)
+    wanted = os.path.join(root, f"folder{target // 100:02d}", f"{letters[target * 7 % 26]}_tune_{target:05d}.mid")
+    for view in midilibrary.VIEWS:
+        midiplayer.library_view = view
+        midiplayer.operation_mode = "MIDI FILE"
+        midiplayer.open_midi_files()
+        goal = midiplayer.pathes.index(wanted)
+        # hold DOWN until the wanted entry's folder or letter shows up, hold it
+        # again while a step does not go past the entry, then press the rest
+        holds = []
+        held = 0.0
+        while lib.section_at(view, midiplayer.selectedindex) != lib.section_at(view, goal):
+            midiplayer.handle_hold("GPIO24", held)
+            held += midiplayer.button_repeat
+        holds.append(held)
+        midiplayer.end_scroll()
+        held = 0.0
+        while held < midiplayer.scroll_sections_after:
+            step = renderer.rows - 1 if held >= midiplayer.scroll_pages_after else 1
+            if held >= midiplayer.scroll_delay and midiplayer.selectedindex + step > goal:
+                break
+            midiplayer.handle_hold("GPIO24", held)
+            held += midiplayer.button_repeat
+        holds.append(held)
+        presses = goal - midiplayer.selectedindex
+        print(f"scroll    {view:<6} entry {goal}: held {' s + '.join(f'{h:.1f}' for h in holds)} s, then {presses} presses "
+              f"(one at a time: {goal})")
+    # a step deep in the list costs what it costs at the top: only the rows on screen are drawn
+    for label, start in (("top", 0), ("deep", target)):
+        midiplayer.selectedindex = start
+        steps = []
+        frames = []
+        for _ in range(100):
+            begin = time.perf_counter()
+            midiplayer.handle_button("GPIO24")
+            steps.append(time.perf_counter() - begin)
+            begin = time.perf_counter()
+            with renderer._spi:
+                renderer._frame(midiplayer.files, midiplayer.selectedindex)
+            frames.append(time.perf_counter() - begin)
+        print(f"scroll    {label:<4} step (us)            {summary(steps)}")
+        print(f"scroll    {label:<4} frame (us)           {summary(frames)}")
+
+def bench_bluetooth(drops=5):
+    discovery = bluetooth.Discovery()
+    manager = bluetooth.ConnectionManager(discovery, os.path.join(workdir, "bluetooth", "trusted.json"))
+    # wait_for() predicates run under the discovery lock: they read the cache directly
+    midi_devices = lambda: [mac for mac, device in list(discovery.devices.items()) if device["midi"] and discovery.is_online(mac)]
+    try:
+        start = time.perf_counter()
+        manager.start()
+        if not discovery.wait_for(midi_devices, 5):
+            raise RuntimeError(f"no BLE-MIDI device found, saw {discovery.online()}")
+        found = time.perf_counter() - start
+        mac = midi_devices()[0]
+        start = time.perf_counter()
+        name = manager.connect(mac, timeout=5)
+        connected = time.perf_counter() - start
+        print(f"bluetooth found {name} ({mac}) in {found * 1e3:.0f} ms, paired, trusted and connected in {connected * 1e3:.0f} ms; "
+              f"listed: {', '.join(listed for listed, _mac in discovery.online())}")
+        # the link drops: the manager reconnects the device on its own, without pairing again
+        samples = []
+        for _ in range(drops):
+            discovery.send(f"disconnect {mac}")
+            discovery.wait_for(lambda: not discovery.devices[mac]["connected"], 5)
+            start = time.perf_counter()
+            if not discovery.wait_for(lambda: discovery.devices[mac]["connected"], 5):
+                raise RuntimeError(f"{mac} was not reconnected")
+            samples.append(time.perf_counter() - start)
+        print(f"bluetooth reconnect after a drop (ms) {summary(samples, 1e3)}")
+        start = time.perf_counter()
+        try:
+            manager.connect("C0:FF:EE:00:00:99", timeout=1)
+        except bluetooth.BluetoothError as e:
+            print(f"bluetooth absent device: {e} after {time.perf_counter() - start:.1f} s; trusted {manager.trusted}")
+    finally:
+        manager.stop()
+    # a restart: the device connected before is remembered and comes back on its own
+    discovery = bluetooth.Discovery()
+    manager = bluetooth.ConnectionManager(discovery, manager.trusted_path)
+    try:
+        start = time.perf_counter()
+        manager.start()
+        if not discovery.wait_for(lambda: mac in discovery.devices and discovery.devices[mac]["connected"], 10):
+            raise RuntimeError(f"{mac} was not reconnected after a restart")
+        print(f"bluetooth remembered device reconnected after a restart in {(time.perf_counter() - start) * 1e3:.0f} ms")
+    finally:
+        manager.stop()
+
+BENCHMARKS = {"input": bench_input, "thru": bench_thru, "playback": bench_playback, "playlist": bench_playlist, "menu": bench_menu, "render": bench_render, "events": bench_events, "offline": bench_offline, "governor": bench_governor, "soundfont": bench_soundfont, "control": bench_control, "record": bench_record, "scroll": bench_scroll, "bluetooth": bench_bluetooth}
+
+def main(names):
+    try:
+        for name in names or BENCHMARKS:
+            BENCHMARKS[name]()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
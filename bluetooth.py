@@ -0,0 +1,325 @@
+import os, re, json, queue, subprocess, threading, time
+import backends
+
+# the stand-in fakebluetoothctl.py with the fake backend; the environment overrides either
+BLUETOOTHCTL = os.environ.get("BLUETOOTHCTL", backends.BLUETOOTHCTL)
+MIDI_SERVICE_UUID = "03b80e5a-ede8-4b33-a751-6ce34ec4c700"
+
+MAC_RE = re.compile(r"([0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5})")
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]|[\x01\x02]")
+PROMPT_RE = re.compile(r"^(\[[^\]]*\][#>]\s*)+")
+
+class Discovery:
+    """
+    Long-lived `bluetoothctl` session that keeps scanning and maintains a
+    timestamped cache of advertising and connected devices.
+
+    Menus read the cache with `online()` and never wait for a scan;
+    `on_change` is called from the reader thread whenever a device appears,
+    changes name or connects/disconnects.
+    """
+
+    def __init__(self, stale_after=60):
+        self.stale_after = stale_after
+        self.devices = {}   # mac -> {"name", "seen", "connected", "paired", "trusted", "midi"}
+        self.on_change = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._proc = None
+        self._thread = None
+        self._info_mac = None
+        self._queried = set()
+
+    def is_running(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        if self.is_running():
+            return
+        self._proc = subprocess.Popen(
+            [BLUETOOTHCTL], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, text=True, bufsize=1
+        )
+        self._queried = set()
+        self._thread = threading.Thread(target=self._read, args=(self._proc,), name="bluetooth", daemon=True)
+        self._thread.start()
+        # connected devices don't advertise, so ask for the paired ones up front
+        self.send("power on")
+        self.send("paired-devices")
+        self.send("scan on")
+
+    def stop(self):
+        proc = self._proc
+        if proc is None:
+            return
+        self._proc = None
+        try:
+            proc.stdin.write("scan off\nexit\n")
+            proc.stdin.flush()
+            proc.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+
+    def add_listener(self, listener):
+        """Call `listener(line)` with every cleaned line bluetoothctl prints."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def device(self, mac):
+        with self._lock:
+            return dict(self.devices.get(mac) or {})
+
+    def wait_for(self, predicate, timeout):
+        """Wait until `predicate()` is true, re-checking after every line of output."""
+        with self._cond:
+            return self._cond.wait_for(predicate, timeout)
+
+    def is_online(self, mac):
+        device = self.devices.get(mac)
+        return device is not None and (device["connected"] or time.monotonic() - device["seen"] < self.stale_after)
+
+    def send(self, command):
+        proc = self._proc
+        if proc is None:
+            return
+        try:
+            proc.stdin.write(command + "\n")
+            proc.stdin.flush()
+        except OSError as e:
+            print("bluetoothctl write failed:", e)
+
+    def online(self):
+        """
+        Return a list of [name, mac] for devices that are online:
+        - seen advertising within the last `stale_after` seconds, OR
+        - currently connected
+        BLE-MIDI devices are listed first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            found = [(not d["midi"], d["name"].lower(), d["name"], mac) for mac, d in self.devices.items()
+                     if d["connected"] or now - d["seen"] < self.stale_after]
+        return [[name, mac] for _midi, _key, name, mac in sorted(found)]
+
+    def _read(self, proc):
+        for line in proc.stdout:
+            line = PROMPT_RE.sub("", ANSI_RE.sub("", line)).strip()
+            if not line:
+                continue
+            changed = self._parse(line)
+            with self._cond:
+                self._cond.notify_all()
+            for listener in list(self._listeners):
+                listener(line)
+            callback = self.on_change
+            if changed and callback is not None:
+                callback()
+        if self._proc is proc:
+            print("bluetoothctl exited")
+            self._proc = None
+
+    def _device(self, mac):
+        device = self.devices.get(mac)
+        if device is None:
+            device = {"name": "", "seen": float("-inf"), "connected": False,
+                      "paired": False, "trusted": False, "midi": False}
+            self.devices[mac] = device
+        return device
+
+    def _parse(self, line):
+        """Update the cache from one line of output. Returns True if the device list changed."""
+        match = MAC_RE.search(line)
+        with self._lock:
+            if line.startswith("Device ") and match:
+                mac = match.group(1)
+                name = line[match.end():].strip()
+                if name in ("(public)", "(random)"):
+                    # first line of `info` output; the fields follow
+                    self._info_mac = mac
+                    return False
+                # listing from paired-devices: look up whether it is connected
+                is_new = mac not in self.devices
+                self._device(mac)["name"] = name or self.devices[mac]["name"]
+                if mac not in self._queried:
+                    self._queried.add(mac)
+                    self.send(f"info {mac}")
+                return is_new
+            if line.startswith(("[NEW] Device", "[CHG] Device", "[DEL] Device")) and match:
+                mac = match.group(1)
+                rest = line[match.end():].strip()
+                if line.startswith("[DEL]"):
+                    return self.devices.pop(mac, None) is not None
+                device = self._device(mac)
+                was_online = device["connected"] or time.monotonic() - device["seen"] < self.stale_after
+                device["seen"] = time.monotonic()
+                if line.startswith("[NEW]"):
+                    device["name"] = rest or device["name"]
+                elif rest.startswith("Name:") or rest.startswith("Alias:"):
+                    name = rest.split(":", 1)[1].strip()
+                    changed = name != device["name"]
+                    device["name"] = name
+                    return changed or not was_online
+                elif rest.startswith("Connected:"):
+                    device["connected"] = rest.endswith("yes")
+                    return True
+                elif rest.startswith("Paired:"):
+                    device["paired"] = rest.endswith("yes")
+                elif rest.startswith("Trusted:"):
+                    device["trusted"] = rest.endswith("yes")
+                elif MIDI_SERVICE_UUID in rest.lower() and not device["midi"]:
+                    device["midi"] = True
+                    return True
+                return not was_online
+            if self._info_mac is not None:
+                # indented fields of `info <mac>`
+                device = self._device(self._info_mac)
+                if line.startswith("Name:"):
+                    device["name"] = line.split(":", 1)[1].strip()
+                elif line.startswith("Connected:"):
+                    device["connected"] = line.endswith("yes")
+                    return device["connected"]
+                elif line.startswith("Paired:"):
+                    device["paired"] = line.endswith("yes")
+                elif line.startswith("Trusted:"):
+                    device["trusted"] = line.endswith("yes")
+                elif MIDI_SERVICE_UUID in line.lower():
+                    device["midi"] = True
+        return False
+
+class BluetoothError(Exception):
+    pass
+
+class ConnectionManager:
+    """
+    Pairs, trusts and connects BLE-MIDI devices through the discovery
+    session's bluetoothctl process.
+
+    Every step waits for the controller's own answer ("Pairing successful",
+    "Connected: yes", ...) instead of sleeping a fixed time. Devices that
+    were connected once are remembered in `trusted_path` and are never
+    removed. They are wanted again whenever the manager starts, so they
+    reconnect after a restart, and a wanted device that drops its link is
+    reconnected in the background.
+    """
+
+    def __init__(self, discovery, trusted_path):
+        self.discovery = discovery
+        self.trusted_path = trusted_path
+        self.wanted = set()
+        self.trusted = {}
+        self._reconnecting = set()
+        self._lock = threading.Lock()
+        try:
+            with open(trusted_path) as f:
+                self.trusted = json.load(f)
+        except (OSError, ValueError):
+            pass
+        discovery.add_listener(self._watch_link)
+
+    def start(self):
+        self.discovery.start()
+        for command in ("pairable on", "agent on", "default-agent"):
+            self.discovery.send(command)
+        with self._lock:
+            self.wanted.update(self.trusted)
+        for mac in list(self.trusted):
+            print(f"Reconnecting to {self.trusted[mac]} ({mac})")
+            self._reconnect_later(mac)
+
+    def stop(self):
+        self.wanted.clear()
+        self.discovery.stop()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.trusted_path), exist_ok=True)
+        tmp = self.trusted_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.trusted, f)
+        os.replace(tmp, self.trusted_path)
+
+    def _run(self, command, success, failure, timeout):
+        """Send one command and wait for a line containing any success/failure marker."""
+        lines = queue.Queue()
+        self.discovery.add_listener(lines.put)
+        try:
+            self.discovery.send(command)
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    line = lines.get(timeout=remaining)
+                except queue.Empty:
+                    return None
+                if any(marker in line for marker in success):
+                    return True
+                if any(marker in line for marker in failure):
+                    return False
+        finally:
+            self.discovery.remove_listener(lines.put)
+
+    def connect(self, mac, timeout=30):
+        """Connect to `mac`, pairing and trusting it first if needed. Returns its name."""
+        deadline = time.monotonic() + timeout
+        remaining = lambda: max(0.1, deadline - time.monotonic())
+        print(f"Connecting to {mac}")
+        if not self.discovery.is_running():
+            self.start()
+        # the controller can only pair with a device it has seen advertising
+        if not self.discovery.wait_for(lambda: self.discovery.is_online(mac), remaining()):
+            raise BluetoothError(f"{mac} is not advertising")
+        device = self.discovery.device(mac)
+        if not device["paired"]:
+            ok = self._run(f"pair {mac}", ("Pairing successful", "Paired: yes", "AlreadyExists"),
+                           ("Failed to pair", "not available"), remaining())
+            if not ok:
+                raise BluetoothError(f"Pairing with {mac} failed")
+        if not device["trusted"]:
+            self._run(f"trust {mac}", ("trust succeeded", "Trusted: yes"), ("Failed to set trusted",), remaining())
+        if not self.discovery.device(mac)["connected"]:
+            ok = self._run(f"connect {mac}", ("Connection successful", "Connected: yes"),
+                           ("Failed to connect",), remaining())
+            if not ok:
+                raise BluetoothError(f"Connect failed for {mac}")
+        name = self.discovery.device(mac)["name"] or device["name"]
+        print(f"Connected to {mac}")
+        with self._lock:
+            self.wanted.add(mac)
+            if self.trusted.get(mac) != name:
+                self.trusted[mac] = name
+                self._save()
+        return name
+
+    def _watch_link(self, line):
+        if not (line.startswith("[CHG] Device") and line.endswith("Connected: no")):
+            return
+        match = MAC_RE.search(line)
+        if match and match.group(1) in self.wanted:
+            print(f"Link to {match.group(1)} dropped, reconnecting")
+            self._reconnect_later(match.group(1))
+
+    def _reconnect_later(self, mac):
+        with self._lock:
+            if mac not in self.wanted or mac in self._reconnecting:
+                return
+            self._reconnecting.add(mac)
+        threading.Thread(target=self._reconnect, args=(mac,), name="reconnect", daemon=True).start()
+
+    def _reconnect(self, mac):
+        delay = 1
+        try:
+            while mac in self.wanted and self.discovery.is_running():
+                try:
+                    self.connect(mac)
+                    return
+                except BluetoothError as e:
+                    print(e)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+        finally:
+            with self._lock:
+                self._reconnecting.discard(mac)
@@ -0,0 +1,198 @@
+import collections, json, os, selectors, socket, threading
+from concurrent.futures import Future
+
+MAX_REQUEST = 64 * 1024  # bytes; a client that sends a longer line is dropped
+NICENESS = 10            # the server thread yields the CPU to playback and live input
+
+def read_thread_states(pid=None):
+    """[name, state, CPU seconds] of every thread, from /proc; state is R (running), S (sleeping), D, ..."""
+    names = {t.native_id: t.name for t in threading.enumerate()}
+    task_directory = f"/proc/{pid or os.getpid()}/task"
+    ticks = os.sysconf("SC_CLK_TCK")
+    threads = []
+    for tid in sorted(os.listdir(task_directory)):
+        try:
+            with open(f"{task_directory}/{tid}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue  # ended meanwhile
+        # the name in parentheses may hold spaces; the fields after it are fixed
+        name = stat[stat.index("(") + 1:stat.rindex(")")]
+        fields = stat[stat.rindex(")") + 2:].split()
+        threads.append([names.get(int(tid), name), fields[0], (int(fields[11]) + int(fields[12])) / ticks])
+    return threads
+
+def read_memory():
+    """Resident and peak resident memory of this process, in bytes."""
+    memory = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _sep, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                memory["rss" if name == "VmRSS" else "peak_rss"] = int(value.split()[0]) * 1024
+    return memory
+
+class _Client:
+    __slots__ = ("incoming", "outgoing", "writing", "closed")
+
+    def __init__(self):
+        self.incoming = b""
+        self.outgoing = bytearray()
+        self.writing = False  # registered for EVENT_WRITE, while replies are backed up
+        self.closed = False
+
+class ControlServer:
+    """
+    Local control and metrics endpoint: line-delimited JSON on a Unix socket.
+
+    A request is one line holding a JSON object with a "cmd", or just the
+    command word; the reply is one line, `handle(request)`'s dict with
+    "ok": true added, or {"ok": false, "error": ...} if it raised. An "id"
+    in the request is copied into its reply. Any number of clients can stay
+    connected and send requests back to back; they are all served by one
+    thread with non-blocking sockets, so a client that stops reading holds
+    up nobody, and the thread runs at a lower CPU priority, so polling
+    never takes time from playback or live input.
+
+    `handle` must not block. For a request that takes a while it returns a
+    Future of the dict instead, and the reply goes out when that is done,
+    while the thread goes on serving everyone else; such replies can
+    overtake each other, which the "id" sorts out.
+    """
+
+    def __init__(self, path, handle):
+        self.path = path
+        self.handle = handle
+        self.requests = 0
+        self._selector = selectors.DefaultSelector()
+        self._listener = None
+        self._thread = None
+        self._finished = collections.deque()  # (connection, client, reply line) of Futures that are done
+        self._wake, self._waker = socket.socketpair()
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            os.remove(self.path)  # left behind by the last run
+        except FileNotFoundError:
+            pass
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        os.chmod(self.path, 0o660)
+        self._listener.listen(8)
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._wake.setblocking(False)
+        self._selector.register(self._wake, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name="control", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICENESS)  # this thread only, on Linux
+        except OSError:
+            pass
+        while True:
+            for key, events in self._selector.select():
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj is self._wake:
+                    self._deliver()
+                else:
+                    self._serve(key.fileobj, key.data, events)
+
+    def _accept(self):
+        try:
+            connection, _address = self._listener.accept()
+        except OSError:
+            return
+        connection.setblocking(False)
+        self._selector.register(connection, selectors.EVENT_READ, _Client())
+
+    def _close(self, connection):
+        self._selector.unregister(connection).data.closed = True  # replies still to come are dropped
+        connection.close()
+
+    def _deliver(self):
+        try:
+            self._wake.recv(4096)
+        except BlockingIOError:
+            pass
+        while self._finished:
+            connection, client, line = self._finished.popleft()
+            if not client.closed:
+                client.outgoing += line
+                self._serve(connection, client, 0)
+
+    def _done(self, connection, client, request, future):
+        # on whichever thread finished the Future: hand the reply to the server thread
+        error = future.exception()
+        self._finished.append((connection, client, self._encode(request, error or future.result())))
+        try:
+            self._waker.send(b"\0")
+        except BlockingIOError:
+            pass  # a wakeup is pending anyway
+
+    def _serve(self, connection, client, events):
+        if events & selectors.EVENT_READ:
+            try:
+                data = connection.recv(65536)
+            except BlockingIOError:
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":  # the client hung up
+                self._close(connection)
+                return
+            if data:
+                lines = (client.incoming + data).split(b"\n")
+                client.incoming = lines.pop()
+                if len(client.incoming) > MAX_REQUEST:
+                    self._close(connection)
+                    return
+                for line in lines:
+                    if line.strip():
+                        client.outgoing += self.reply(line, connection, client)
+        if client.outgoing:
+            try:
+                del client.outgoing[:connection.send(client.outgoing)]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self._close(connection)
+                return
+        writing = bool(client.outgoing)
+        if writing != client.writing:
+            client.writing = writing
+            self._selector.modify(connection, selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0), client)
+
+    def reply(self, line, connection=None, client=None):
+        """The encoded reply line to one request line; empty if it is sent once a Future is done."""
+        self.requests += 1
+        request = {}
+        try:
+            text = line.decode().strip()
+            request = json.loads(text) if text.startswith("{") else {"cmd": text}
+            if not isinstance(request, dict) or not isinstance(request.get("cmd"), str):
+                raise ValueError('expected {"cmd": ...}')
+            result = self.handle(request)
+        except Exception as e:
+            result = e
+        if isinstance(result, Future) and client is not None:
+            result.add_done_callback(lambda future: self._done(connection, client, request, future))
+            return b""
+        if isinstance(result, Future):
+            result = result.exception() or result.result()
+        return self._encode(request, result)
+
+    def _encode(self, request, result):
+        """The reply line for `result`, a dict, None or the exception `handle` raised."""
+        if isinstance(result, KeyError):
+            reply = {"ok": False, "error": f"missing {result}"}
+        elif isinstance(result, Exception):
+            reply = {"ok": False, "error": str(result) or type(result).__name__}
+        else:
+            reply = {"ok": True, **(result or {})}
+        if isinstance(request, dict) and "id" in request:
+            reply["id"] = request["id"]
+        return (json.dumps(reply, separators=(",", ":")) + "\n").encode()
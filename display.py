@@ -0,0 +1,137 @@
+import threading, time
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageDraw
+
+ROW_HEIGHT = 30
+TOP = 10              # menu rows start 10 px from the top, as they always have
+LEFT = 10
+STATUS_ROW = 2        # where "Please Wait" and job progress are shown
+FRAME_INTERVAL = 1 / 60
+CACHE_SIZE = 192      # rendered rows kept around (about 14 KiB each)
+
+# (background, text colour) per row style
+STYLES = {
+    "normal": ((0, 0, 0), (255, 255, 255)),
+    "selected": ((255, 255, 255), (0, 0, 0)),
+    "notice": ((235, 235, 235), (255, 0, 0)),
+}
+
+TRANSPOSE = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+
+def rgb565(image):
+    """Big-endian RGB565 bytes for an image, the format the ST7789 expects."""
+    pb = np.array(image.convert("RGB")).astype("uint16")
+    color = ((pb[:, :, 0] & 0xF8) << 8) | ((pb[:, :, 1] & 0xFC) << 3) | (pb[:, :, 2] >> 3)
+    return np.dstack(((color >> 8) & 0xFF, color & 0xFF)).astype("uint8").tobytes()
+
+class Renderer:
+    """
+    Menu renderer for the ST7789 that only sends rows that changed.
+
+    Each row is rendered once per (text, style) and kept as ready-to-send
+    RGB565 data. `show()` just records the latest menu state; a render thread
+    diffs it against what is on the panel and pushes only the changed rows,
+    at most once per FRAME_INTERVAL, so a burst of button presses costs one
+    frame.
+    """
+
+    def __init__(self, disp, font, rotation=0):
+        self.disp = disp
+        self.font = font
+        self.rotation = rotation
+        self.width = disp.width
+        self.height = disp.height
+        self.rows = (self.height - TOP + ROW_HEIGHT - 1) // ROW_HEIGHT  # last row may be clipped
+        self.frames = 0
+        self.frame_time = 0.0
+        self._cache = OrderedDict()
+        self._shown = [None] * self.rows
+        self._pending = None
+        self._spi = threading.Lock()
+        self._cond = threading.Condition()
+        self.clear()
+        self._thread = threading.Thread(target=self._run, name="display", daemon=True)
+        self._thread.start()
+
+    def clear(self):
+        with self._spi:
+            self.disp.display(Image.new("RGB", (self.width, self.height), color=(0, 0, 0)))
+            self._shown = [None] * self.rows
+
+    def show(self, lines, selected, status=None):
+        """
+        Schedule a redraw of the menu; only the latest state is drawn.
+        `status`, if given, is shown over STATUS_ROW.
+        """
+        with self._cond:
+            self._pending = (lines, selected, status)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                lines, selected, status = self._pending
+                self._pending = None
+            start = time.perf_counter()
+            with self._spi:
+                self._frame(lines, selected, status)
+            elapsed = time.perf_counter() - start
+            self.frames += 1
+            self.frame_time = elapsed
+            if elapsed < FRAME_INTERVAL:
+                time.sleep(FRAME_INTERVAL - elapsed)
+
+    def _frame(self, lines, selected, status=None):
+        top = max(0, selected - (self.rows - 2))
+        for row in range(self.rows):
+            i = top + row
+            key = None
+            if status is not None and row == STATUS_ROW:
+                key = (status, "notice")
+            elif i < len(lines):
+                key = (lines[i], "selected" if i == selected else "normal")
+            if key != self._shown[row]:
+                self._push_row(row, key)
+
+    def _tile(self, key, height):
+        cached = self._cache.get((key, height))
+        if cached is not None:
+            self._cache.move_to_end((key, height))
+        else:
+            text, style = key if key is not None else ("", "normal")
+            background, color = STYLES[style]
+            tile = Image.new("RGB", (self.width, height), color=(0, 0, 0))
+            draw = ImageDraw.Draw(tile)
+            if style != "normal":
+                draw.rectangle([LEFT, 0, self.width - LEFT, ROW_HEIGHT - 1], fill=background)
+            if text:
+                draw.text((LEFT, 0), text, font=self.font, fill=color)
+            if self.rotation in TRANSPOSE:
+                tile = tile.transpose(TRANSPOSE[self.rotation])
+            if len(self._cache) >= CACHE_SIZE:
+                self._cache.popitem(last=False)
+            cached = rgb565(tile)
+            self._cache[(key, height)] = cached
+        return cached
+
+    def _push_row(self, row, key):
+        y0 = TOP + row * ROW_HEIGHT
+        y1 = min(y0 + ROW_HEIGHT, self.height) - 1
+        data = self._tile(key, y1 - y0 + 1)
+        self.disp.set_window(*self._panel_window(0, y0, self.width - 1, y1))
+        self.disp.data(data)
+        self._shown[row] = key
+
+    def _panel_window(self, x0, y0, x1, y1):
+        """Map a window in menu coordinates to panel coordinates for the rotation."""
+        w, h = self.width, self.height
+        if self.rotation == 90:
+            return y0, w - 1 - x1, y1, w - 1 - x0
+        if self.rotation == 180:
+            return w - 1 - x1, h - 1 - y1, w - 1 - x0, h - 1 - y0
+        if self.rotation == 270:
+            return h - 1 - y1, x0, h - 1 - y0, x1
+        return x0, y0, x1, y1
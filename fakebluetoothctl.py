@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Stand-in for `bluetoothctl`, selected with MIDIPLAYER_BACKEND=fake (or by
+pointing BLUETOOTHCTL at it).
+
+Reads the commands bluetooth.Discovery and ConnectionManager send on stdin
+and answers the way bluetoothctl does, prompts and colour codes included,
+for a BLE-MIDI keyboard and a pair of headphones that advertise while
+scanning is on. Pairing and connecting take a short while, like the real
+controller; `disconnect <mac>` drops the link as if the device went out of
+range.
+"""
+import sys, threading, time
+
+MIDI_SERVICE_UUID = "03b80e5a-ede8-4b33-a751-6ce34ec4c700"
+DEVICES = {
+    "C0:FF:EE:00:00:01": ("Fake BLE Keys", True),   # name, offers the BLE-MIDI service
+    "C0:FF:EE:00:00:02": ("Fake Headphones", False),
+}
+ADVERTISE_INTERVAL = 0.5  # seconds between advertisements while scanning
+PAIR_TIME = 0.2
+CONNECT_TIME = 0.1
+PROMPT = "\x1b[0;94m[bluetooth]\x1b[0m# "
+
+devices = {mac: {"name": name, "midi": midi, "paired": False, "trusted": False, "connected": False}
+           for mac, (name, midi) in DEVICES.items()}
+scanning = threading.Event()
+output = threading.Lock()
+
+def say(*lines):
+    with output:
+        for line in lines:
+            sys.stdout.write(PROMPT + line + "\n")
+        sys.stdout.flush()
+
+def advertise():
+    # the first advertisement of a device is [NEW], the rest only update its signal strength
+    announced = set()
+    while True:
+        scanning.wait()
+        for mac, device in devices.items():
+            if device["connected"]:
+                continue  # connected devices stop advertising
+            if mac not in announced:
+                announced.add(mac)
+                say(f"[NEW] Device {mac} {device['name']}")
+                if device["midi"]:
+                    say(f"[CHG] Device {mac} UUIDs: {MIDI_SERVICE_UUID}")
+            else:
+                say(f"[CHG] Device {mac} RSSI: -{50 + len(announced)}")
+        time.sleep(ADVERTISE_INTERVAL)
+
+def change(mac, field, value):
+    devices[mac][field] = value
+    say(f"[CHG] Device {mac} {field.capitalize()}: {'yes' if value else 'no'}")
+
+def info(mac, device):
+    say(f"Device {mac} (public)")
+    lines = [f"Name: {device['name']}", f"Alias: {device['name']}"]
+    lines += [f"{field.capitalize()}: {'yes' if device[field] else 'no'}" for field in ("paired", "trusted", "connected")]
+    if device["midi"]:
+        lines.append(f"UUID: Vendor specific           ({MIDI_SERVICE_UUID})")
+    with output:
+        sys.stdout.write("".join("\t" + line + "\n" for line in lines))
+        sys.stdout.flush()
+
+def run(command, args):
+    argument = args[0] if args else ""
+    mac = argument.upper()
+    device = devices.get(mac)
+    if command in ("power", "pairable"):
+        say(f"Changing {command} {argument} succeeded")
+    elif command == "agent":
+        say("Agent registered")
+    elif command == "default-agent":
+        say("Default agent request successful")
+    elif command == "scan":
+        if argument == "on":
+            say("Discovery started")
+            scanning.set()
+        else:
+            scanning.clear()
+            say("Discovery stopped")
+    elif command == "paired-devices":
+        for paired_mac, paired in devices.items():
+            if paired["paired"]:
+                say(f"Device {paired_mac} {paired['name']}")
+    elif command in ("info", "pair", "trust", "connect", "disconnect") and device is None:
+        say(f"Device {argument} not available")
+    elif command == "info":
+        info(mac, device)
+    elif command == "pair":
+        say(f"Attempting to pair with {mac}")
+        time.sleep(PAIR_TIME)
+        if device["paired"]:
+            say("Failed to pair: org.bluez.Error.AlreadyExists")
+            return
+        change(mac, "paired", True)
+        say("Pairing successful")
+    elif command == "trust":
+        change(mac, "trusted", True)
+        say(f"Changing {mac} trust succeeded")
+    elif command == "connect":
+        say(f"Attempting to connect to {mac}")
+        time.sleep(CONNECT_TIME)
+        if not device["paired"]:
+            say("Failed to connect: org.bluez.Error.Failed")
+            return
+        change(mac, "connected", True)
+        say("Connection successful")
+    elif command == "disconnect":
+        say(f"Attempting to disconnect from {mac}")
+        change(mac, "connected", False)
+        say("Successful disconnected")
+    else:
+        say(f"Invalid command in menu main: {command}")
+
+def main():
+    threading.Thread(target=advertise, daemon=True).start()
+    for line in sys.stdin:
+        words = line.split()
+        if not words:
+            continue
+        if words[0] in ("exit", "quit"):
+            break
+        run(words[0], words[1:])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Stand-ins for the Pi hardware, selected with MIDIPLAYER_BACKEND=fake.
+
+They keep the same call signatures as fluidsynth.Synth, rtmidi.MidiIn/MidiOut,
+gpiozero.Button and st7789.ST7789 so the player and the benchmarks run on any
+Linux box, and they record what they were asked to do.
+"""
+import os, sys, time
+import numpy as np
+from PIL import ImageFont
+
+class RecordingSynth:
+    """fluidsynth.Synth that records (perf_counter, method, args) instead of making sound."""
+
+    def __init__(self, **settings):
+        self.settings = dict(settings)
+        self.calls = []
+        self.started = False
+        self.cpu_load = 0.0     # what get_cpu_load() reports, set by the benchmarks
+        self.voices = 0
+        self._fonts = {}
+        self._next_sfid = 1
+
+    def _record(self, name, *args):
+        self.calls.append((time.perf_counter(), name, args))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._record(name, *args)
+
+    def start(self, driver=None, device=None, midi_driver=None, midi_router=None):
+        self.started = True
+
+    def delete(self):
+        self.started = False
+
+    def setting(self, key, value):
+        self.settings[key] = value
+
+    def get_setting(self, key):
+        return self.settings.get(key)
+
+    def get_cpu_load(self):
+        return self.cpu_load
+
+    def get_active_voice_count(self):
+        return self.voices
+
+    def sfload(self, filename, update_midi_preset=0):
+        if not os.path.exists(filename):
+            return -1
+        sfid = self._next_sfid
+        self._next_sfid += 1
+        self._fonts[sfid] = filename
+        return sfid
+
+    def sfunload(self, sfid, update_midi_preset=0):
+        return 0 if self._fonts.pop(sfid, None) else -1
+
+    def program_select(self, chan, sfid, bank, preset):
+        self._record("program_select", chan, sfid, bank, preset)
+        return 0 if sfid in self._fonts else -1
+
+    def get_samples(self, len=1024):
+        return np.zeros(2 * len, dtype="int16")
+
+virtual_inputs = ["Virtual Keyboard 20:0"]
+virtual_outputs = ["Virtual Synth 128:0"]
+_open_inputs = {}     # port name -> [MidiIn]
+sent = {}             # output port name -> [(perf_counter, message)]
+
+def plug_input(name):
+    virtual_inputs.append(name)
+
+def unplug_input(name):
+    virtual_inputs.remove(name)
+    for midi_in in _open_inputs.pop(name, []):
+        midi_in.port = None
+
+def send_input(name, message, delta=None):
+    """
+    Deliver `message` to every MidiIn that has port `name` open, like a key
+    press. `delta` defaults to the real time since the port's last message.
+    """
+    for midi_in in list(_open_inputs.get(name, ())):
+        midi_in._deliver(message, delta)
+
+class MidiIn:
+    def __init__(self, *args, **kwargs):
+        self.port = None
+        self._callback = None
+        self._data = None
+        self._last = None
+
+    def get_ports(self):
+        return list(virtual_inputs)
+
+    def open_port(self, port=0, name=None):
+        self.port = virtual_inputs[port]
+        self._last = None
+        _open_inputs.setdefault(self.port, []).append(self)
+
+    def open_virtual_port(self, name=None):
+        plug_input(name or "Virtual Input")
+        self.open_port(len(virtual_inputs) - 1)
+
+    def is_port_open(self):
+        return self.port is not None
+
+    def close_port(self):
+        if self.port is not None and self in _open_inputs.get(self.port, []):
+            _open_inputs[self.port].remove(self)
+        self.port = None
+
+    def set_callback(self, func, data=None):
+        self._callback = func
+        self._data = data
+
+    def cancel_callback(self):
+        self._callback = None
+
+    def ignore_types(self, sysex=True, timing=True, active_sense=True):
+        pass
+
+    def _deliver(self, message, delta):
+        now = time.perf_counter()
+        if delta is None:
+            delta = 0.0 if self._last is None else now - self._last
+        self._last = now
+        if self._callback is not None:
+            self._callback((message, delta), self._data)
+
+class MidiOut:
+    def __init__(self, *args, **kwargs):
+        self.port = None
+
+    def get_ports(self):
+        return list(virtual_outputs)
+
+    def open_port(self, port=0, name=None):
+        self.port = virtual_outputs[port]
+        sent.setdefault(self.port, [])
+
+    def is_port_open(self):
+        return self.port is not None
+
+    def close_port(self):
+        self.port = None
+
+    def send_message(self, message):
+        sent[self.port].append((time.perf_counter(), list(message)))
+
+def audio_command(path):
+    """Takes as long as the WAV at `path` would play, without a sound card."""
+    script = "import sys, time, wave; w = wave.open(sys.argv[1]); time.sleep(w.getnframes() / w.getframerate())"
+    return [sys.executable, "-c", script, path]
+
+# answers like bluetoothctl, for a BLE-MIDI keyboard and a pair of headphones
+BLUETOOTHCTL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakebluetoothctl.py")
+
+buttons = {}
+
+class Button:
+    """
+    gpiozero.Button driven from code: press("GPIO5") runs its when_pressed,
+    hold("GPIO24", 3) its when_held as often as holding it for 3 seconds
+    would, with held_time as gpiozero counts it, but without waiting.
+    """
+
+    def __init__(self, pin, hold_time=1, hold_repeat=False):
+        self.pin = f"GPIO{pin}"
+        self.hold_time = hold_time
+        self.hold_repeat = hold_repeat
+        self.held_time = 0.0
+        self.when_pressed = None
+        self.when_held = None
+        self.when_released = None
+        buttons[self.pin] = self
+
+    def press(self):
+        if self.when_pressed is not None:
+            self.when_pressed(self)
+
+    def hold(self, seconds):
+        self.press()
+        # gpiozero counts held_time from the first when_held
+        held = 0.0
+        while self.hold_time + held <= seconds:
+            self.held_time = held
+            if self.when_held is not None:
+                self.when_held(self)
+            if not self.hold_repeat:
+                break
+            held += self.hold_time
+        self.held_time = 0.0
+        if self.when_released is not None:
+            self.when_released(self)
+
+def press(pin):
+    buttons[pin].press()
+
+def hold(pin, seconds):
+    buttons[pin].hold(seconds)
+
+class FramebufferDisplay:
+    """ST7789 that writes into a numpy RGB565 framebuffer and counts what was sent."""
+
+    def __init__(self, width=240, height=240, rotation=0):
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+        panel = (width, height) if rotation in (0, 180) else (height, width)
+        self.framebuffer = np.zeros((panel[1], panel[0]), dtype="uint16")
+        self.bytes_sent = 0
+        self.windows = 0
+        self._window = (0, 0, panel[0] - 1, panel[1] - 1)
+
+    def begin(self):
+        pass
+
+    def set_window(self, x0=0, y0=0, x1=None, y1=None):
+        rows, cols = self.framebuffer.shape
+        self._window = (x0, y0, cols - 1 if x1 is None else x1, rows - 1 if y1 is None else y1)
+        self.windows += 1
+
+    def data(self, data):
+        x0, y0, x1, y1 = self._window
+        pixels = np.frombuffer(bytes(data), dtype="uint8").astype("uint16").reshape(-1, 2)
+        self.framebuffer[y0:y1 + 1, x0:x1 + 1] = ((pixels[:, 0] << 8) | pixels[:, 1]).reshape(y1 - y0 + 1, x1 - x0 + 1)
+        self.bytes_sent += len(data)
+
+    def display(self, image):
+        import display
+        self.set_window()
+        rotated = image.transpose(display.TRANSPOSE[self.rotation]) if self.rotation in display.TRANSPOSE else image
+        self.data(display.rgb565(rotated))
+
+def Synth(**settings):
+    return RecordingSynth(**settings)
+
+def Display(display_type):
+    if display_type == "rect":
+        return FramebufferDisplay(240, 135, 0), 0
+    if display_type == "dhmini":
+        return FramebufferDisplay(320, 240, 180), 180
+    return FramebufferDisplay(240, 240, 90), 90
+
+def load_font(size):
+    try:
+        return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
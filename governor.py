@@ -0,0 +1,200 @@
+import glob, json, os, threading, time
+import backends
+
+CPU_CORES = max(1, (os.cpu_count() or 1) - 1)  # one core stays free for MIDI input and the menu
+
+# FluidSynth settings per audio preset: audio.* sets the sound card buffer
+# (period size in frames, number of periods), synth.* the synthesis
+AUDIO_PRESETS = {
+    "low-latency": {"audio.period-size": 64, "audio.periods": 3, "synth.polyphony": 64,
+                    "synth.chorus.active": 0, "synth.cpu-cores": 1},
+    "balanced": {"audio.period-size": 128, "audio.periods": 4, "synth.polyphony": 128,
+                 "synth.cpu-cores": CPU_CORES},
+    "high-quality": {"audio.period-size": 1024, "audio.periods": 4, "synth.polyphony": 256,
+                     "synth.cpu-cores": CPU_CORES},
+}
+DEFAULT_PRESET = "balanced"
+
+CHECK_INTERVAL = 0.5   # seconds between load checks
+HIGH_LOAD = 75.0       # synth CPU load (% of real time) above which work is shed
+LOW_LOAD = 40.0        # load below which it is given back...
+RECOVER_CHECKS = 10    # ...after this many calm checks in a row
+MIN_POLYPHONY = 16
+
+# each stage gives up more sound for CPU than the one before:
+# (share of the preset's polyphony, chorus allowed, reverb allowed)
+STAGES = [(1.0, True, True), (1.0, False, True), (0.75, False, False), (0.5, False, False), (0.25, False, False)]
+
+# voice stealing: (FluidSynth default, under load); under load released and
+# quiet voices are dropped first, so new notes - live ones above all - get a voice
+OVERFLOW = {
+    "synth.overflow.released": (-2000.0, -4000.0),
+    "synth.overflow.sustained": (-1000.0, -2000.0),
+    "synth.overflow.volume": (500.0, 1000.0),
+}
+
+class AlsaStatus:
+    """
+    Underrun check for this process's ALSA playback stream, from /proc/asound.
+
+    The kernel resets avail_max each time the status is read, so avail_max
+    reaching the buffer size means the buffer ran dry since the last check.
+    """
+
+    def __init__(self, status_path, buffer_size):
+        self.status_path = status_path
+        self.buffer_size = buffer_size
+
+    @classmethod
+    def find(cls, pid=None):
+        """The status of the playback stream that `pid` (this process) has open, or None."""
+        owner = str(pid or os.getpid())
+        for path in glob.glob("/proc/asound/card*/pcm*p/sub*/status"):
+            try:
+                status = read_fields(path)
+                if status.get("owner_pid") == owner:
+                    hw_params = read_fields(os.path.join(os.path.dirname(path), "hw_params"))
+                    return cls(path, int(hw_params["buffer_size"]))
+            except (OSError, KeyError, ValueError):
+                continue
+        return None
+
+    def ran_dry(self):
+        try:
+            status = read_fields(self.status_path)
+        except OSError:
+            return False
+        return status.get("state") == "XRUN" or int(status.get("avail_max", 0)) >= self.buffer_size
+
+def read_fields(path):
+    """The "name : value" lines of a /proc/asound file as a dict."""
+    fields = {}
+    with open(path) as f:
+        for line in f:
+            name, sep, value = line.partition(":")
+            if sep:
+                fields[name.strip()] = value.strip()
+    return fields
+
+class LoadGovernor:
+    """
+    Keeps FluidSynth within the CPU it has, so playing stays glitch-free
+    when a dense file is playing as well.
+
+    Every CHECK_INTERVAL it reads the synth's CPU load and, with the ALSA
+    driver, whether the sound card's buffer ran dry since the last check.
+    Overload sheds work one stage at a time (chorus, reverb, then polyphony,
+    with voice stealing set to drop released and quiet voices first), an
+    underrun two stages at once; a stretch of low load gives it back one
+    stage at a time. All of these are realtime synth settings, so sounding
+    notes carry on. The audio preset and whether the governor runs are kept
+    in `settings_path`.
+    """
+
+    def __init__(self, settings_path):
+        self.settings_path = settings_path
+        self.preset = DEFAULT_PRESET
+        self.enabled = True
+        self.stage = 0
+        self.load = None        # last synth CPU load, % of real time; None if it cannot be read
+        self.voices = 0
+        self.underruns = 0
+        self._synth = None
+        self._cpu_load = None
+        self._alsa = None
+        self._calm = 0          # calm checks in a row
+        self._thread = None
+        self._lock = threading.Lock()
+        try:
+            with open(settings_path) as f:
+                data = json.load(f)
+            if data.get("preset") in AUDIO_PRESETS:
+                self.preset = data["preset"]
+            self.enabled = bool(data.get("enabled", True))
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.settings_path), exist_ok=True)
+        tmp = self.settings_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"preset": self.preset, "enabled": self.enabled}, f)
+        os.replace(tmp, self.settings_path)
+
+    def synth_settings(self):
+        """Settings of the current preset, for creating the synth."""
+        return dict(AUDIO_PRESETS[self.preset])
+
+    def set_preset(self, preset):
+        """Remember `preset`; it takes effect when the synth is next created."""
+        self.preset = preset
+        self._save()
+
+    def toggle(self):
+        with self._lock:
+            self.enabled = not self.enabled
+            if not self.enabled and self._synth is not None:
+                self._set_stage(0)
+            self._save()
+
+    def attach(self, synth):
+        """Govern `synth`, which has just been started with the current preset."""
+        with self._lock:
+            self._synth = synth
+            self._cpu_load = backends.synth_method(synth, "get_cpu_load")
+            self._alsa = AlsaStatus.find()
+            self.stage = 0
+            self._calm = 0
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="governor", daemon=True)
+                self._thread.start()
+
+    def detach(self):
+        with self._lock:
+            self._synth = None
+
+    def status(self):
+        load = "load ?" if self.load is None else f"load {self.load:.0f}%"
+        return f"{load}, {self.voices} voices, stage {self.stage}"
+
+    def _run(self):
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            with self._lock:
+                if self.enabled and self._synth is not None:
+                    self.check()
+
+    def check(self):
+        """One load check; called with the lock held."""
+        self.load = self._cpu_load() if self._cpu_load is not None else None
+        self.voices = self._synth.get_active_voice_count() or 0
+        dry = self._alsa is not None and self._alsa.ran_dry()
+        if dry:
+            self.underruns += 1
+            print(f"Audio underrun ({self.status()})")
+        if dry or (self.load is not None and self.load > HIGH_LOAD):
+            self._calm = 0
+            self._set_stage(self.stage + (2 if dry else 1))
+        elif self.load is None or self.load < LOW_LOAD:
+            self._calm += 1
+            if self._calm >= RECOVER_CHECKS:
+                self._calm = 0
+                self._set_stage(self.stage - 1)
+        else:
+            self._calm = 0
+
+    def _set_stage(self, stage):
+        stage = max(0, min(stage, len(STAGES) - 1))
+        if stage == self.stage and stage != 0:
+            return
+        share, chorus, reverb = STAGES[stage]
+        preset = self.synth_settings()
+        synth = self._synth
+        synth.setting("synth.polyphony", max(MIN_POLYPHONY, int(preset.get("synth.polyphony", 256) * share)))
+        synth.setting("synth.chorus.active", int(chorus and preset.get("synth.chorus.active", 1)))
+        synth.setting("synth.reverb.active", int(reverb and preset.get("synth.reverb.active", 1)))
+        for key, (normal, under_load) in OVERFLOW.items():
+            synth.setting(key, under_load if stage else normal)
+        if stage != self.stage:
+            print(f"Synth load governor: stage {self.stage} -> {stage} ({self.status()})")
+        self.stage = stage
@@ -0,0 +1,296 @@
+import os, json, threading, time, struct, ctypes, bisect, mido
+
+INDEX_VERSION = 1
+POLL_INTERVAL = 30     # seconds between rescans when inotify is unavailable
+SETTLE_TIME = 0.5      # wait for a burst of file changes to finish
+PLAYLIST_EXTENSION = ".m3u"
+VIEWS = ("folder", "name")  # MIDI FILE orders: grouped by folder, or A-Z across folders
+
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+def display_name(filename, extension):
+    return filename.replace(extension, "").replace("_", " ")
+
+def initial(name):
+    """Section label of a name in the A-Z view: its first letter, or "#"."""
+    first = name[:1].upper()
+    return first if first.isalpha() else "#"
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def read_metadata(path):
+    """Duration in seconds, track count and initial tempo (BPM) of a MIDI file."""
+    mid = mido.MidiFile(path)
+    tempo = 500000
+    for track in mid.tracks:
+        msg = next((m for m in track if m.type == "set_tempo"), None)
+        if msg is not None:
+            tempo = msg.tempo
+            break
+    return {
+        "duration": mid.length,
+        "tracks": len(mid.tracks),
+        "tempo": round(mido.tempo2bpm(tempo), 1),
+    }
+
+def read_playlist(path):
+    """Paths listed in an M3U playlist, one per line; relative ones are relative to the playlist."""
+    base = os.path.dirname(path)
+    paths = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.append(os.path.normpath(os.path.join(base, line)))
+    return paths
+
+def sections(labels):
+    """(starts, labels) of the runs of equal labels in `labels`."""
+    starts = []
+    runs = []
+    for i, label in enumerate(labels):
+        if not runs or runs[-1] != label:
+            starts.append(i)
+            runs.append(label)
+    return starts, runs
+
+class Library:
+    """
+    On-disk index of the MIDI files below `root`.
+
+    Directories are only re-listed when their mtime changes, so startup just
+    loads the saved index and stats the directory tree. After that the index is
+    kept current from inotify events (or a slow poll) in a background thread,
+    and `listing()` hands the menu a ready-made pair of lists. Every view
+    (VIEWS) is built whenever the index changes, along with its sections,
+    the index where each folder or initial letter starts, so the menu can
+    jump between them without looking at the entries.
+    """
+
+    def __init__(self, root, index_path, extension=".mid"):
+        self.root = root
+        self.index_path = index_path
+        self.extension = extension
+        self.on_change = None
+        self._lock = threading.Lock()
+        self._dirs = {}    # dirpath -> {"mtime": float, "subdirs": [...]}
+        self._files = {}   # path -> {"size", "mtime", and metadata once read}
+        self._listing = ([], [])
+        self._views = {view: ([], [], ([], [])) for view in VIEWS}
+        self._thread = None
+
+    def load(self):
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("root") == self.root:
+                self._dirs = data["dirs"]
+                self._files = data["files"]
+        except (OSError, ValueError, KeyError) as e:
+            print("Library index not loaded:", e)
+        self._rebuild_listing()
+
+    def save(self):
+        with self._lock:
+            data = {"version": INDEX_VERSION, "root": self.root, "dirs": self._dirs, "files": self._files}
+            tmp = self.index_path + ".tmp"
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.index_path)
+
+    def listing(self, view="folder"):
+        """Return (paths, names) for the menu, in the order of `view`. Treat both lists as read-only."""
+        paths, names, _sections = self._views[view]
+        return paths, names
+
+    def sections(self, view="folder"):
+        """(starts, labels) of the sections of `view`: the index of the first entry of each folder or letter."""
+        return self._views[view][2]
+
+    def section_at(self, view, index):
+        """Index of the section that entry `index` of `view` is in, or -1 if there are none."""
+        return bisect.bisect_right(self._views[view][2][0], index) - 1
+
+    def info(self, path):
+        return self._files.get(path)
+
+    def directories(self):
+        return list(self._dirs)
+
+    def files_below(self, dirpath):
+        """Sorted paths of the files in `dirpath` and its subdirectories."""
+        prefix = os.path.join(dirpath, "")
+        return [path for path in self._listing[0] if path.startswith(prefix)]
+
+    def add(self, path):
+        """Index a file that was just written, without waiting for a rescan."""
+        self.refresh({os.path.dirname(path)})
+
+    def refresh(self, dirty=()):
+        """Re-list directories whose mtime changed (or that are in `dirty`)."""
+        changed = False
+        seen = set()
+        pending = [self.root]
+        while pending:
+            dirpath = pending.pop()
+            seen.add(dirpath)
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            known = self._dirs.get(dirpath)
+            if known is not None and known["mtime"] == mtime and dirpath not in dirty:
+                pending.extend(known["subdirs"])
+                continue
+            subdirs = self._scan_dir(dirpath)
+            with self._lock:
+                self._dirs[dirpath] = {"mtime": mtime, "subdirs": subdirs}
+            pending.extend(subdirs)
+            changed = True
+        with self._lock:
+            for dirpath in [d for d in self._dirs if d not in seen]:
+                del self._dirs[dirpath]
+                changed = True
+            for path in [p for p in self._files if os.path.dirname(p) not in self._dirs]:
+                del self._files[path]
+                changed = True
+        if changed:
+            self._rebuild_listing()
+        return changed
+
+    def _scan_dir(self, dirpath):
+        subdirs = []
+        present = set()
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(self.extension):
+                    st = entry.stat()
+                    present.add(entry.path)
+                    old = self._files.get(entry.path)
+                    if old is None or old["mtime"] != st.st_mtime or old["size"] != st.st_size:
+                        with self._lock:
+                            self._files[entry.path] = {"size": st.st_size, "mtime": st.st_mtime}
+        with self._lock:
+            for path in [p for p in self._files if os.path.dirname(p) == dirpath and p not in present]:
+                del self._files[path]
+        return subdirs
+
+    def _rebuild_listing(self):
+        with self._lock:
+            paths = sorted(self._files)
+            names = []
+            for path in paths:
+                name = display_name(os.path.basename(path), self.extension)
+                duration = self._files[path].get("duration")
+                if duration is not None:
+                    name = f"{name} {format_duration(duration)}"
+                names.append(name)
+            self._listing = (paths, names)
+            top = os.path.basename(self.root) + "/"
+            folders = [top if os.path.dirname(path) == self.root else os.path.relpath(os.path.dirname(path), self.root) + "/"
+                       for path in paths]
+            order = sorted(range(len(paths)), key=lambda i: names[i].casefold())
+            self._views = {
+                "folder": (paths, names, sections(folders)),
+                "name": ([paths[i] for i in order], [names[i] for i in order], sections([initial(names[i]) for i in order])),
+            }
+        if self.on_change is not None:
+            self.on_change()
+
+    def _read_missing_metadata(self):
+        """Fill in metadata for new or modified files. Returns True if any was read."""
+        todo = [p for p, f in list(self._files.items()) if "duration" not in f]
+        for path in todo:
+            try:
+                meta = read_metadata(path)
+            except Exception as e:
+                print(f"Could not read {path}: {e}")
+                meta = {"duration": None, "tracks": 0, "tempo": 0}
+            with self._lock:
+                if path in self._files:
+                    self._files[path].update(meta)
+        return bool(todo)
+
+    def start(self):
+        """Load the index and keep it current from a background thread."""
+        self.load()
+        self._thread = threading.Thread(target=self._watch, name="library", daemon=True)
+        self._thread.start()
+
+    def _update(self, dirty=()):
+        changed = self.refresh(dirty)
+        if self._read_missing_metadata():
+            self._rebuild_listing()
+            changed = True
+        if changed:
+            self.save()
+
+    def _watch(self):
+        self._update()
+        try:
+            notify = Inotify()
+        except OSError as e:
+            print("inotify unavailable, polling the library:", e)
+            while True:
+                time.sleep(POLL_INTERVAL)
+                self._update()
+        while True:
+            for dirpath in self.directories():
+                notify.watch(dirpath)
+            dirty = notify.read()
+            time.sleep(SETTLE_TIME)
+            dirty |= notify.read(block=False)
+            self._update(dirty)
+
+class Inotify:
+    """Minimal ctypes wrapper: watch directories, return the ones that changed."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(0)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths = {}   # wd -> dirpath
+        self._watched = set()
+
+    def watch(self, dirpath):
+        if dirpath in self._watched:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+        if wd >= 0:
+            self._paths[wd] = dirpath
+            self._watched.add(dirpath)
+
+    def read(self, block=True):
+        if not block:
+            import select
+            if not select.select([self._fd], [], [], 0)[0]:
+                return set()
+        dirty = set()
+        buf = os.read(self._fd, 65536)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, length = struct.unpack_from("iIII", buf, offset)
+            offset += 16 + length
+            dirpath = self._paths.get(wd)
+            if dirpath is None:
+                continue
+            dirty.add(dirpath)
+            if mask & IN_DELETE_SELF:
+                del self._paths[wd]
+                self._watched.discard(dirpath)
+        return dirty
@@ -0,0 +1,206 @@
+import backends, threading, time
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+POLY_PRESSURE = 0xA0
+CONTROL_CHANGE = 0xB0
+PROGRAM_CHANGE = 0xC0
+CHANNEL_PRESSURE = 0xD0
+PITCH_BEND = 0xE0
+SYSEX = 0xF0
+SYSEX_END = 0xF7
+REALTIME = 0xF8  # clock, start/stop, active sensing: no effect on running status
+
+# data bytes after each channel-voice status byte
+DATA_LENGTH = {NOTE_OFF: 2, NOTE_ON: 2, POLY_PRESSURE: 2, CONTROL_CHANGE: 2,
+               PROGRAM_CHANGE: 1, CHANNEL_PRESSURE: 1, PITCH_BEND: 2}
+
+LATENCY_BUCKETS = 24  # bucket n counts latencies below 2**n microseconds
+
+class PortClock:
+    """Timestamp baseline of one input port, passed to the rtmidi callback as its data."""
+    __slots__ = ("stream_time", "base")
+
+    def __init__(self):
+        self.stream_time = 0.0   # sum of rtmidi deltas since the port was opened
+        self.base = float("inf")  # smallest perf_counter - stream_time offset seen
+
+class LatencyStats:
+    """
+    Histogram of the time from rtmidi's arrival timestamp to now.
+
+    rtmidi timestamps each message on arrival and passes the time since the
+    previous one, so the offset between the summed timestamps and
+    perf_counter is constant for messages handled at once, and anything above
+    the smallest offset seen is time spent waiting. The counters are shared
+    by all ports and not locked; they are statistics, not state.
+    """
+
+    def __init__(self):
+        self.histogram = [0] * LATENCY_BUCKETS
+        self.count = 0
+        self.max_latency = 0.0
+        self._clock = time.perf_counter
+        self._default_clock = PortClock()
+
+    def record(self, delta, clock=None):
+        if clock is None:
+            clock = self._default_clock
+        clock.stream_time += delta
+        offset = self._clock() - clock.stream_time
+        if offset < clock.base:
+            clock.base = offset
+        self.add(offset - clock.base)
+
+    def add(self, latency):
+        """Count one latency, in seconds, that the caller measured itself."""
+        if latency > self.max_latency:
+            self.max_latency = latency
+        bucket = int(latency * 1e6).bit_length() if latency > 0 else 0
+        self.histogram[bucket if bucket < LATENCY_BUCKETS else LATENCY_BUCKETS - 1] += 1
+        self.count += 1
+
+    def reset(self):
+        self.histogram = [0] * LATENCY_BUCKETS
+        self.count = 0
+        self.max_latency = 0.0
+
+    def percentile(self, q):
+        """Upper bound of the latency below which a fraction `q` of messages fell, in seconds."""
+        target = q * self.count
+        seen = 0
+        for bucket, n in enumerate(self.histogram):
+            seen += n
+            if n and seen >= target:
+                return (1 << bucket) / 1e6
+        return 0.0
+
+    def snapshot(self):
+        """The counters as plain numbers in microseconds; the histogram lists [upper bound, count] of non-empty buckets."""
+        return {"count": self.count, "p50_us": round(self.percentile(0.5) * 1e6), "p99_us": round(self.percentile(0.99) * 1e6),
+                "max_us": round(self.max_latency * 1e6, 1),
+                "histogram": [[1 << bucket, n] for bucket, n in enumerate(self.histogram) if n]}
+
+    def report(self):
+        return (f"{self.count} messages, latency p50 < {self.percentile(0.5) * 1e3:.3f} ms, "
+                f"p99 < {self.percentile(0.99) * 1e3:.3f} ms, max {self.max_latency * 1e3:.3f} ms")
+
+class LiveInput:
+    """
+    Sends live MIDI input to FluidSynth.
+
+    Every status byte indexes a 256-entry table that is built once per synth:
+    (function, channel, data length), where the function is the bound synth
+    (or SoundFont pool) method itself wherever the argument order allows it.
+    An event is a table lookup and one call, with no decoding chain and
+    nothing allocated. Data bytes without a status byte reuse the last one
+    (running status), so a packet of several events is handled in one call,
+    and short or unknown messages are counted instead of raising.
+
+    `callback()` can be handed to rtmidi directly, once per open port with
+    its own PortClock, and records the time until the synth call returned.
+    Synth calls are made holding a lock, which `detach()` takes too, so once
+    it returns the synth is not in use and can be deleted.
+    """
+
+    def __init__(self):
+        self.table = [None] * 256
+        self.sysex = None
+        self.latency = LatencyStats()
+        self.ignored = 0          # short, unknown or unsupported messages
+        self._running = 0         # running status byte, 0 when there is none
+        self._lock = threading.Lock()  # held while the synth is called
+
+    def attach(self, synth, pool):
+        """Build the dispatch table for `synth`, with program and bank changes going through `pool`."""
+        self._cc = synth.cc
+        self._noteoff = synth.noteoff
+        self._pitch_bend = synth.pitch_bend
+        self._bank_select = pool.bank_select
+        functions = {
+            NOTE_OFF: self._note_off,
+            NOTE_ON: synth.noteon,  # FluidSynth treats velocity 0 as note off itself
+            POLY_PRESSURE: backends.synth_method(synth, "key_pressure"),
+            CONTROL_CHANGE: self._control_change,
+            PROGRAM_CHANGE: pool.program_change,
+            CHANNEL_PRESSURE: backends.synth_method(synth, "channel_pressure"),
+            PITCH_BEND: self._pitch_wheel,
+        }
+        table = [None] * 256
+        for kind, function in functions.items():
+            if function is None:
+                print(f"Synth cannot handle status {kind:#x}, ignoring it")
+                continue
+            for channel in range(16):
+                table[kind | channel] = (function, channel, DATA_LENGTH[kind])
+        self.sysex = backends.synth_method(synth, "sysex")
+        self.table = table
+
+    def detach(self):
+        """Ignore input from now on, until attach() is called again (for a synth that is going away)."""
+        with self._lock:  # waits for a message that is being sent to the synth
+            self.table = [None] * 256
+            self.sysex = None
+
+    def _note_off(self, channel, note, velocity):
+        self._noteoff(channel, note)
+
+    def _control_change(self, channel, control, value):
+        if control == 0:  # bank select MSB
+            self._bank_select(channel, value)
+        self._cc(channel, control, value)
+
+    def _pitch_wheel(self, channel, lsb, msb):
+        self._pitch_bend(channel, (msb << 7 | lsb) - 8192)
+
+    def dispatch(self, message):
+        """Send one raw MIDI message (a list or bytes) to the synth."""
+        end = len(message)
+        if end == 0:
+            return
+        status = message[0]
+        if status < 0x80:  # running status: data bytes only
+            status = self._running
+            i = 0
+        elif status < SYSEX:
+            self._running = status
+            i = 1
+        elif status == SYSEX:
+            self._running = 0
+            with self._lock:
+                if self.sysex is not None and end > 2 and message[end - 1] == SYSEX_END:
+                    self.sysex(bytes(message[1:end - 1]))
+                    return
+            self.ignored += 1
+            return
+        else:
+            if status < REALTIME:  # system common cancels running status
+                self._running = 0
+            return
+        with self._lock:
+            entry = self.table[status]
+            if entry is None or i + entry[2] > end:
+                self.ignored += 1
+                return
+            function, channel, length = entry
+            if length == 2:
+                while i + 2 <= end:
+                    function(channel, message[i], message[i + 1])
+                    i += 2
+            else:
+                while i < end:
+                    function(channel, message[i])
+                    i += 1
+
+    def callback(self, message_data, clock=None):
+        """rtmidi input callback: dispatch, then record the latency."""
+        message, delta = message_data
+        self.dispatch(message)
+        self.latency.record(delta, clock)
+
+    def reset_stats(self):
+        self.latency.reset()
+        self.ignored = 0
+
+    def latency_report(self):
+        return f"{self.latency.report()}, {self.ignored} ignored"
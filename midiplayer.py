@@ -1,8 +1,7 @@
 #!/usr/bin/env python3
 
-import sys, git, threading, time, os, fluidsynth, st7789, rtmidi, subprocess, select, mido
-from gpiozero import Button, DigitalOutputDevice
-from PIL import Image, ImageDraw, ImageFont
+import sys, threading, time, os, subprocess, select, random
+import backends, playback, offline, soundfonts, display, bluetooth, ports, router, ui, livemidi, governor, control, recorder as midirecorder, library as midilibrary
 
 MESSAGE = ""
 directory = os.path.expanduser("~")
@@ -10,44 +9,90 @@ if(directory=="/root"):
     directory="/home/pi"
 
 file_extension = '.mid'
+cache_directory = directory + "/.midiplayer"
 soundfontname = "/usr/share/sounds/sf2/General_MIDI_64_1.6.sf2"
-
-button1 = Button(5)
-button2 = Button(6)
-button3 = Button(16)
-button4 = Button(24)
-
-fs = fluidsynth.Synth()
-fs.start(driver="alsa")
-sfid = fs.sfload(soundfontname,True)
-
-pathes = ["MIDI INPUT", "MIDI OUTPUT", "SOUND FONT", "MIDI FILE", "BLUETOOTH"]
-files = ["MIDI INPUT", "MIDI OUTPUT", "SOUND FONT", "MIDI FILE", "BLUETOOTH"]
+soundfont_memory_budget = 96 * 1024 * 1024  # bytes of SoundFonts kept loaded for quick switching
+load_presets_on_demand = True  # load only the samples of presets that are played, not whole SoundFonts
+synth_settings = {"gain": 0.2, "samplerate": 44100}  # also part of the rendered-audio cache key
+# play MIDI files from audio rendered ahead of time, through aplay: only where aplay can
+# share the sound card with FluidSynth (e.g. dmix); the hifiberry DAC's default device cannot
+use_render_cache = False
+render_cache_budget = 2 * 1024 * 1024 * 1024  # bytes of rendered MIDI files kept on disk
+render_workers = 1  # MIDI files rendered at once; every render process loads the SoundFont of its own
+event_cache_budget = 64 * 1024 * 1024  # bytes of parsed MIDI files kept on disk
+seek_step = 10      # seconds per PLAYBACK back/forward press
+tempo_step = 0.1    # tempo change per PLAYBACK slower/faster press
+playlist_directory = directory + "/playlists"  # saved playlists, .m3u files listing MIDI files
+shuffle_playlists = False
+library_view = "folder"  # MIDI FILE order: "folder" (grouped by folder) or "name" (A-Z across folders)
+button_repeat = 0.1       # seconds between steps while UP/DOWN is held...
+scroll_delay = 0.4        # ...once it has been held this long (a press is shorter)
+scroll_pages_after = 2    # seconds held before it moves a page per step...
+scroll_sections_after = 4  # ...and a folder or letter per step in MIDI FILE
+
+update_check_timeout = 15  # seconds before a hanging git fetch is killed
+
+soundfont_catalog = soundfonts.Catalog(cache_directory + "/soundfonts.json")
+render_cache = offline.RenderCache(cache_directory + "/renders", soundfont_catalog.cache_path, render_cache_budget, render_workers)
+
+# created by start_synth() once the menu is already on screen
+fs = None
+soundfont_pool = None
+live_input = livemidi.LiveInput()  # ignores input until the synth is attached
+# audio preset, and the governor that sheds synth work under load
+synth_governor = governor.LoadGovernor(cache_directory + "/audio.json")
+
+main_menu = ["MIDI INPUT", "MIDI OUTPUT", "SOUND FONT", "MIDI FILE", "PLAYLIST", "PLAYBACK", "RECORD", "AUDIO", "BLUETOOTH"]
+pathes = list(main_menu)
+files = list(main_menu)
 selectedindex = 0
+dispatcher = ui.Dispatcher()  # owns pathes/files/selectedindex/operation_mode
 use_bluetooth = 0
-midi_playback_active = False  # Track if a MIDI file is currently playing
+# plays MIDI files to FluidSynth or external ports, each parsed once into the event cache
+player = playback.Player(playback.EventCache(cache_directory + "/events", event_cache_budget))
+audio_stream = offline.AudioStream()  # plays MIDI files that were rendered before
+now_playing = None  # path of the MIDI file last started
+bt_discovery = bluetooth.Discovery()
+bt_connections = bluetooth.ConnectionManager(bt_discovery, cache_directory + "/trusted.json")
+port_watcher = ports.PortWatcher()
+# live input goes to FluidSynth and any other outputs chosen in MIDI OUTPUT
+midi_router = router.Router(port_watcher, live_input.dispatch, cache_directory + "/routes.json")
+# every wanted input port feeds the router directly, each with its own timestamp clock
+input_merger = ports.InputMerger(port_watcher, midi_router.callback, cache_directory + "/inputs.json",
+                                 lambda port: livemidi.PortClock())
+library = midilibrary.Library(directory + "/midifiles", cache_directory + "/library.json", file_extension)
+recorder = midirecorder.Recorder(library.root + "/recordings")  # live input, saved into the library
 
 repo_path = os.path.dirname(os.path.abspath(__file__))
 display_type = "square"
 
-midiin = rtmidi.MidiIn()
-midiout = rtmidi.MidiOut()
-midioutname="FLUIDSYNTH"
-input_ports = midiin.get_ports()
-output_ports = midiout.get_ports()
-for i, port in enumerate(input_ports):
-    print(f"{i}: {port}")
-midi_input_index = len(input_ports) - 1
-print(f"Using MIDI input: {input_ports[midi_input_index]}")
 
 operation_mode = "main screen"
-previous_operation_mode = "main_screen"
+scroll_label = None  # folder or letter shown while a held UP/DOWN jumps through them
+boot_time = time.monotonic()
+startup_times = []  # (phase, seconds after boot it started, seconds it took)
+
+def timed(phase, fn, *args):
+    """Run one startup phase and record when it started and how long it took."""
+    start = time.monotonic()
+    try:
+        return fn(*args)
+    finally:
+        startup_times.append((phase, start - boot_time, time.monotonic() - start))
+
+def print_startup_report():
+    print("Startup timing:")
+    for phase, started, took in sorted(startup_times, key=lambda t: t[1]):
+        print(f"  {phase:<14} +{started * 1000:7.0f} ms  took {took * 1000:7.0f} ms")
 
 def check_for_updates(repo_path):
+    if backends.BACKEND != "hardware":
+        return False
     try:
+        import git
         repo = git.Repo(repo_path)
         origin = repo.remotes.origin
-        origin.fetch()
+        origin.fetch(kill_after_timeout=update_check_timeout)
         local_commit = repo.head.object.hexsha
         remote_commit = origin.refs[repo.active_branch.name].object.hexsha
         if local_commit != remote_commit:
@@ -61,497 +106,776 @@ def check_for_updates(repo_path):
         print("Error checking for updates:", e)
         return False
 
-def select_first_preset(synth, sfid):
-    for bank in range(128):
-        for preset in range(128):
-            if synth.program_select(0, sfid, bank, preset):
-                print(f"Selected Bank {bank}, Preset {preset}")
-                return
-    raise ValueError("No presets found in the SoundFont")
+def button_pressed(bt):
+    # runs on gpiozero's thread: hand the press to the UI thread and return
+    dispatcher.post(handle_button, str(bt.pin))
 
-def init_buttons():
-    button1.when_pressed = handle_button
-    button2.when_pressed = handle_button
-    button3.when_pressed = handle_button
-    button4.when_pressed = handle_button
-
-def midi_callback(message_data, timestamp):
-    message, _ = message_data
-    status = message[0] & 0xF0
-    channel = message[0] & 0x0F
-    
-    #print(f"Raw MIDI: {[hex(b) for b in message]}")
-    
-    if status == 0xC0 and len(message) == 2:  # Program Change
-        program = message[1]
-        #print(f"Program change to {program} on channel {channel}")
-        fs.program_change(channel, program)
-        return  # Program Change is 2 bytes - no note/velocity to read
-
-    note = message[1]
-    velocity = message[2]
-   
-    #print(f"status: {status} channel: {channel}, note: {note}, velocity: {velocity}")
-
-    if status == 0x90:  # note_on
-        if velocity > 0:
-            fs.noteon(channel, note, velocity)
-        else:
-            fs.noteoff(channel, note)  # velocity 0 = note_off
-    elif status == 0x80:  # note_off
-        fs.noteoff(channel, note)
-    elif status == 0xB0:  # control_change
-        fs.cc(channel, note, velocity)
-    elif status == 0xE0:  # pitchwheel
-        pitch = (velocity << 7) + note - 8192
-        fs.pitch_bend(channel, pitch)
-
-def midi_listener():
-    midiin = rtmidi.MidiIn()
-    ports = midiin.get_ports()
-    if not ports:
-        print("No MIDI input ports found.")
-        return
-    midiin.open_port(len(ports) - 1)
-    midiin.set_callback(midi_callback)
-    while True:
-        time.sleep(1)  # Keep thread alive
+def button_held(bt):
+    # runs on gpiozero's thread, every button_repeat while UP or DOWN is held
+    dispatcher.post(handle_hold, str(bt.pin), bt.held_time)
 
-import subprocess, time, select, sys
+def button_released(bt):
+    dispatcher.post(end_scroll)
 
-def _scan_live_advertising(scan_time=8):
-    """
-    Return dict MAC->Name for devices that advertise during the live scan window.
-    Only captures NEW/CHG events seen in real time (no cache).
-    """
-    proc = subprocess.Popen(
-        ["bluetoothctl"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
-
-    # start scanning
-    proc.stdin.write("scan on\n")
-    proc.stdin.flush()
-
-    advertising = {}
-    start = time.time()
-    poller = select.poll()
-    poller.register(proc.stdout, select.POLLIN)
-
-    while time.time() - start < scan_time:
-        events = poller.poll(200)  # 200ms
-        for _fd, _ev in events:
-            line = proc.stdout.readline()
-            if not line:
-                continue
-            # bluetoothctl formats to catch:
-            # [NEW] Device MAC NAME
-            # [CHG] Device MAC RSSI: ...
-            # Device MAC NAME   (some builds)
-            line = line.strip()
-            if "Device" in line:
-                parts = line.split()
-                # find MAC (XX:XX:XX:XX:XX:XX) and optional name after it
-                mac = next((p for p in parts if ":" in p and len(p) == 17), None)
-                if mac:
-                    # name is everything after MAC on the line (if present)
-                    idx = line.find(mac)
-                    name = line[idx + len(mac):].strip()
-                    if name.startswith("RSSI"):  # no name on CHG RSSI-only lines
-                        name = advertising.get(mac, "")
-                    advertising[mac] = name or advertising.get(mac, "")
-
-    # stop scanning and exit
-    try:
-        proc.stdin.write("scan off\n")
-        proc.stdin.flush()
-    except Exception:
-        pass
-    proc.stdin.write("exit\n")
-    proc.stdin.flush()
-    proc.wait(timeout=2)
+def init_buttons():
+    global button1, button2, button3, button4
+    button1 = backends.Button(5)
+    button2 = backends.Button(6)
+    button3 = backends.Button(16, hold_time=button_repeat, hold_repeat=True)
+    button4 = backends.Button(24, hold_time=button_repeat, hold_repeat=True)
+    button1.when_pressed = button_pressed
+    button2.when_pressed = button_pressed
+    button3.when_pressed = button_pressed
+    button4.when_pressed = button_pressed
+    for button in (button3, button4):
+        button.when_held = button_held
+        button.when_released = button_released
+
+# rtmidi calls the router directly, and the router the table-driven decoder: no wrapper on the hot path
+midi_callback = midi_router.callback
+ALL_INPUTS = "ALL INPUTS"
 
-    return advertising
+import subprocess, time, select, sys
 
-def _paired_connected_now():
+def get_online_devices():
     """
-    Return dict MAC->Name for paired devices that are currently Connected: yes.
+    Return a list of [name, mac] for devices that are online, straight from
+    the discovery service's cache - opening a menu never waits for a scan.
     """
-    connected = {}
-    # list paired devices
-    pd = subprocess.run(["bluetoothctl", "paired-devices"], capture_output=True, text=True)
-    for line in pd.stdout.splitlines():
-        # Format: Device MAC NAME
-        if line.startswith("Device "):
-            parts = line.split(" ", 2)
-            if len(parts) >= 3:
-                mac, name = parts[1], parts[2]
-                info = subprocess.run(["bluetoothctl", "info", mac], capture_output=True, text=True)
-                if "Connected: yes" in info.stdout:
-                    connected[mac] = name
-    return connected
-
-def get_online_devices(scan_time=8):
-    global use_bluetooth
-    result = []
     if use_bluetooth==1:
-        """
-        Return a list of [name, mac] for devices that are online:
-        - Currently advertising (seen during live scan), OR
-        - Currently connected (paired devices with Connected: yes)
-        """
-        adv = _scan_live_advertising(scan_time)
-        con = _paired_connected_now()
-
-        # Union: prefer names from 'adv' when available, else from 'con'
-        macs = set(adv.keys()) | set(con.keys())
-        for mac in macs:
-            name = adv.get(mac) or con.get(mac) or ""
-            # Trim leading punctuation if any
-            name = name.strip()
-            result.append([name, mac])
-    return result
-
-def btctl(cmds, timeout=15):
-    """Run a series of bluetoothctl commands in one session, return combined stdout."""
-    proc = subprocess.Popen(
-        ["bluetoothctl"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT, text=True, bufsize=1
-    )
-    for c in cmds:
-        proc.stdin.write(c + "\n")
-        proc.stdin.flush()
-        time.sleep(0.3)
-    try:
-        out, _ = proc.communicate(timeout=timeout)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-        out = ""
-    return out
+        return bt_discovery.online()
+    return []
+
+def bluetooth_devices_changed():
+    # called from the discovery thread
+    dispatcher.post(refresh_device_list)
+
+def refresh_device_list():
+    # show devices in the open MIDI INPUT/OUTPUT list as soon as they appear
+    if operation_mode == "MIDI INPUT":
+        show_list(*input_menu(), keep_selection=True)
+    elif operation_mode == "MIDI OUTPUT":
+        show_list(*output_menu(), keep_selection=True)
+
+def midi_ports_changed(added_in, removed_in, added_out, removed_out):
+    # called from the port watcher thread, after the input merger has reattached
+    dispatcher.post(refresh_device_list)
+
+def library_changed():
+    # called from the library thread
+    dispatcher.post(refresh_file_list)
+
+def refresh_file_list():
+    if operation_mode == "MIDI FILE":
+        show_list(*library.listing(library_view), keep_selection=True)
+
+def input_menu():
+    # "* " marks the inputs that are merged into the synth
+    pathes = [ALL_INPUTS]
+    files = [("* " if input_merger.merge_all else "") + ALL_INPUTS]
+    for port in port_watcher.inputs:
+        pathes.append(port)
+        files.append(("* " if port in input_merger.opened else "") + port)
+    for mac,name in get_online_devices():
+        pathes.append(name)
+        files.append(mac)
+    return pathes, files
+
+def output_menu():
+    # "* " marks the outputs that live input and MIDI files are sent to
+    pathes = [router.SYNTH]
+    files = [("* " if midi_router.is_active(router.SYNTH) else "") + router.SYNTH]
+    for port in port_watcher.outputs:
+        pathes.append(port)
+        files.append(("* " if midi_router.is_active(port) else "") + port)
+    for mac,name in get_online_devices():
+        pathes.append(name)
+        files.append(mac)
+    return pathes, files
 
 def connect_ble_device(mac):
-    global use_bluetooth
     if use_bluetooth==1:
-        print("Connecting to ${mac}")
-        btctl(["power on", "pairable on", "agent on", "default-agent"])
-        btctl([f"remove {mac}"])  # clear stale record
-
-        # make sure device object exists
-        btctl(["scan on"])
-        time.sleep(5)
-        btctl(["scan off"])
-
-        # try pairing
-        out = btctl([f"pair {mac}"])
-        if "not available" in out.lower():
-            time.sleep(3)
-            btctl(["scan on"]); time.sleep(5); btctl(["scan off"])
-            out = btctl([f"pair {mac}"])
-
-        # trust + connect
-        btctl([f"trust {mac}"])
-        out = btctl([f"connect {mac}"])
-        if "Connection successful" in out or "Connected: yes" in out:
-            print(f"Connected to {mac}")
+        try:
+            bt_connections.connect(mac)
             return True
+        except bluetooth.BluetoothError as e:
+            print(e)
+    return False
 
-        raise RuntimeError(f"Connect failed for {mac}: {out.strip()}")
+def wait_for_midi_port(port_name_substring, timeout=10, outputs=False):
+    if use_bluetooth==1:
+        print("Waiting for MIDI Port")
+        return port_watcher.wait_for(port_name_substring, timeout, outputs)
+    return None
+
+# Everything below runs on the dispatcher thread only.
+
+def show_list(new_pathes, new_files, index=0, keep_selection=False):
+    global pathes, files, selectedindex
+    if keep_selection:
+        # keep the highlight on the same entry when items are inserted above it
+        selected = pathes[selectedindex] if selectedindex < len(pathes) else None
+        index = new_pathes.index(selected) if selected in new_pathes else selectedindex
+    pathes = new_pathes
+    files = new_files
+    selectedindex = max(0, min(index, len(files) - 1))
+    update_display()
 
-def resetsynth():
-    global selectedindex, files, pathes, fs, operation_mode, previous_operation_mode, soundfontname, midi_playback_active
-    midi_playback_active = False  # Signal any active playback thread to stop
+def go_main_screen():
+    global operation_mode
+    previous = operation_mode
     operation_mode = "main screen"
-    pathes = ["MIDI INPUT", "MIDI OUTPUT", "SOUND FONT", "MIDI FILE", "BLUETOOTH"]
-    files = ["MIDI INPUT", "MIDI OUTPUT", "SOUND FONT", "MIDI FILE", "BLUETOOTH"]
-    selectedindex = 0
-    fs.delete()
-    fs = fluidsynth.Synth()
-    fs.start(driver="alsa")
-    sfid = fs.sfload(soundfontname,True)
-
-def remove_all_devices():
-    global use_bluetooth
-    macs = []
-    if use_bluetooth==1:
-        print("Removing all BLE Devices")
-        """Remove all registered Bluetooth devices from the controller."""
-        # Get list of paired devices
-        result = subprocess.run(
-            ["bluetoothctl", "devices"],
-            capture_output=True, text=True
-        )
-        for line in result.stdout.splitlines():
-            if line.startswith("Device "):
-                parts = line.split(" ", 2)
-                if len(parts) >= 2:
-                    macs.append(parts[1])
-
-        # Remove each device
-        for mac in macs:
-            print(f"Removing {mac}")
-            subprocess.run(["bluetoothctl", "remove", mac])
-
-    return macs
-
-def wait_for_midi_port(port_name_substring, timeout=10):
-    global use_bluetooth
-    if use_bluetooth==1:
-        print("Wating for MIDI Port")
-        """
-        Wait until a MIDI port containing `port_name_substring` appears.
-        Returns the full port name or None if timeout expires.
-        """
-        midi_in = rtmidi.MidiIn()
-        start = time.time()
-        while time.time() - start < timeout:
-            ports = midi_in.get_ports()
-            for p in ports:
-                if port_name_substring.lower() in p.lower():
-                    return p
-            time.sleep(0.5)  # wait a bit before retrying
-        return None
-
-def index_of_substring(lst, substring):
-    for i, val in enumerate(lst):
-        if substring in val:
-            return i
-    return -1  # return -1 if not found, like JS indexOf
-
-def handle_button(bt):
-    global midioutname, selectedindex, files, pathes, fs, operation_mode, previous_operation_mode, soundfontname, draw, disp, use_bluetooth
-    if str(bt.pin) == "GPIO16":
+    show_list(list(main_menu), list(main_menu), main_menu.index(previous) if previous in main_menu else 0)
+
+def resetsynth():
+    player.cancel()
+    audio_stream.stop()
+    go_main_screen()
+    # stop all notes but keep the synth, audio driver and loaded fonts
+    if soundfont_pool is not None:
+        soundfont_pool.reset()
+
+def handle_button(pin):
+    global selectedindex
+    if pin == "GPIO16":
         selectedindex -= 1
-    if str(bt.pin) == "GPIO24":
+    if pin == "GPIO24":
         selectedindex += 1
     selectedindex = max(0, min(selectedindex, len(files) - 1))
-    if str(bt.pin) == "GPIO6":
+    if pin == "GPIO6":
         resetsynth()
-    if str(bt.pin) == "GPIO5":
-        if operation_mode == "main screen":
-            pathes = ["MIDI INPUT", "MIDI OUTPUT", "SOUND FONT", "MIDI FILE", "BLUETOOTH"]
-            files = ["MIDI INPUT", "MIDI OUTPUT", "SOUND FONT", "MIDI FILE", "BLUETOOTH"]
-            operation_mode = pathes[selectedindex]
-        if operation_mode == "BLUETOOTH":
-            if previous_operation_mode == operation_mode:
-                operation_mode="main screen"
-                use_bluetooth=selectedindex
-            else:
-                selectedindex=use_bluetooth
-                pathes=["OFF","ON"]
-                files=["OFF","ON"]
-            previous_operation_mode = operation_mode
-        if operation_mode=="MIDI OUTPUT":
-            midiout = rtmidi.MidiOut()
-            if previous_operation_mode == operation_mode:
-                midiout = rtmidi.MidiOut()
-                # If the selected output port name changed (e.g., BLE reconnect)
-                if files[selectedindex] != pathes[selectedindex]:
-                    draw.rectangle([10, 10 + (2 * 30), 230, 40 + (2 * 30)], fill=(235, 235, 235))
-                    draw.text((10, 10 + (2 * 30)), "Please Wait", font=font, fill=(255, 0, 0))
-                    disp.display(img)
-                    remove_all_devices()
-                    connect_ble_device(pathes[selectedindex])
-                    wait_for_midi_port(files[selectedindex])
-                    # Recalculate index based on actual available output ports
-                    selectedindex = index_of_substring(midiout.get_ports(), files[selectedindex])
-                # Close previously opened port
-                if midiout.is_port_open():
-                    midiout.close_port()
-                # Open the selected output port
-                midiout.open_port(selectedindex)
-                midioutname=files[selectedindex]
-            else:
-                pathes = ["FLUIDSYNTH"]
-                files = ["FLUIDSYNTH"]
-                input_ports = midiout.get_ports()
-                for port in input_ports:
-                    pathes.append(port)
-                    files.append(port)
-                # scan for new BT devices only once
-                draw.rectangle([10, 10 + (2 * 30), 230, 40 + (2 * 30)], fill=(235, 235, 235))
-                draw.text((10, 10 + (2 * 30)), "Please Wait", font=font, fill=(255, 0, 0))
-                disp.display(img)
-                remove_all_devices()
-                for mac,name in get_online_devices(7):
-                    pathes.append(name)
-                    files.append(mac)
-            previous_operation_mode = operation_mode
-        if operation_mode == "MIDI INPUT":
-            midiin = rtmidi.MidiIn()
-            if previous_operation_mode == operation_mode:
-                if(files[selectedindex]!=pathes[selectedindex]):
-                    draw.rectangle([10, 10 + (2 * 30), 230, 40 + (2 * 30)], fill=(235, 235, 235))
-                    draw.text((10, 10 + (2 * 30)), "Please Wait", font=font, fill=(255, 0, 0))
-                    disp.display(img)
-                    remove_all_devices()
-                    print(pathes[selectedindex])
-                    print(files[selectedindex])
-                    connect_ble_device(pathes[selectedindex])
-                    wait_for_midi_port(files[selectedindex])
-                    selectedindex = index_of_substring(midiin.get_ports(), files[selectedindex])
-                if midiin.is_port_open():
-                    midiin.close_port()
-                midiin.open_port(selectedindex)
-                midiin.set_callback(midi_callback)
-                sfid = fs.sfload(soundfontname,True)
-                try:
-                    select_first_preset(fs, sfid)
-                except ValueError as e:
-                    print(e)
-                fs.set_reverb(0.9, 0.5, 0.8, 0.7)
-            else:
-                pathes = []
-                files = []
-                input_ports = midiin.get_ports()
-                for port in input_ports:
-                    pathes.append(port)
-                    files.append(port)
-                # scan for new BT devices only once
-                draw.rectangle([10, 10 + (2 * 30), 230, 40 + (2 * 30)], fill=(235, 235, 235))
-                draw.text((10, 10 + (2 * 30)), "Please Wait", font=font, fill=(255, 0, 0))
-                disp.display(img)
-                remove_all_devices()
-                for mac,name in get_online_devices(7):
-                    pathes.append(name)
-                    files.append(mac)
-            previous_operation_mode = operation_mode
-        if operation_mode == "SOUND FONT":
-            pathes = []
-            files = []
-            target_directory = os.readlink(directory + "/sf2")
-            for dirpath, dirnames, filenames in os.walk(target_directory):
-                for filename in filenames:
-                    if filename.endswith(".sf2"):
-                        pathes.append(dirpath + "/" + filename)
-                        files.append(filename.replace(".sf2", "").replace("_", " "))
-            if previous_operation_mode == operation_mode:
-                soundfontname = pathes[selectedindex]
-                resetsynth()
-            previous_operation_mode = operation_mode
-        if operation_mode == "MIDI FILE":
-            pathes = []
-            files = []
-            for dirpath, dirnames, filenames in os.walk(directory + "/midifiles"):
-                for filename in filenames:
-                    if filename.endswith(file_extension):
-                        pathes.append(dirpath + "/" + filename)
-                        files.append(filename.replace(".mid", "").replace("_", " "))
-            if previous_operation_mode == operation_mode:
-                if midioutname == "FLUIDSYNTH":
-                    operation_mode = "main screen"
-                    # Play in a background thread so buttons keep working
-                    midi_file_path = pathes[selectedindex]
-                    def _play_fluidsynth(filepath):
-                        global fs, midi_playback_active
-                        midi_playback_active = True
-                        # Reuse existing synth - just play the file
-                        fs.play_midi_file(filepath)
-                        midi_playback_active = False
-                    playback_thread = threading.Thread(target=_play_fluidsynth, args=(midi_file_path,), daemon=True)
-                    playback_thread.start()
-                else:
-                    operation_mode = "main screen"
-                    midifilems = pathes[selectedindex]      # MIDI file path
-                    portnamems = midioutname               # Full RtMidi port name
-                    # Play MIDO in a background thread so buttons keep working
-                    def _play_mido(filepath, portname):
-                        global midi_playback_active
-                        midi_playback_active = True
-                        outport_name = None
-                        for name in mido.get_output_names():
-                            if portname in name or name in portname:
-                                outport_name = name
-                                break
-                        if outport_name is None:
-                            print("ERROR: Could not find matching MIDO output port!")
-                        else:
-                            outport = mido.open_output(outport_name)
-                            mid = mido.MidiFile(filepath)
-                            for msg in mid:
-                                if not midi_playback_active:
-                                    break  # Stop playback if reset was pressed
-                                time.sleep(msg.time)
-                                if not msg.is_meta:
-                                    outport.send(msg)
-                            outport.close()
-                        midi_playback_active = False
-                    playback_thread = threading.Thread(target=_play_mido, args=(midifilems, portnamems), daemon=True)
-                    playback_thread.start()
-            previous_operation_mode = operation_mode
+    if pin == "GPIO5":
+        if dispatcher.busy is not None:
+            # remember the press and replay it once the job is done
+            dispatcher.defer(handle_button, pin)
+            return
+        select_entry()
+    update_display()
+
+def handle_hold(pin, held_time):
+    # a held UP/DOWN moves a row per step, then a page, then (in MIDI FILE) to
+    # the next folder or letter, from the sections the library built with its index
+    global selectedindex, scroll_label
+    if held_time < scroll_delay:
+        return
+    step = -1 if pin == "GPIO16" else 1
+    starts, labels = library.sections(library_view) if operation_mode == "MIDI FILE" else ((), ())
+    if held_time >= scroll_sections_after and starts:
+        section = library.section_at(library_view, selectedindex)
+        if step > 0:
+            section += 1
+        elif starts[section] == selectedindex:
+            section -= 1
+        section = max(0, min(section, len(starts) - 1))
+        selectedindex = starts[section]
+        scroll_label = labels[section]
+    elif held_time >= scroll_pages_after:
+        selectedindex += step * (renderer.rows - 1)
+    else:
+        selectedindex += step
+    selectedindex = max(0, min(selectedindex, len(files) - 1))
     update_display()
 
+def end_scroll():
+    global scroll_label
+    if scroll_label is not None:
+        scroll_label = None
+        update_display()
+
+def select_entry():
+    global operation_mode
+    if operation_mode == "main screen":
+        operation_mode = pathes[selectedindex]
+        screens[operation_mode][0]()
+    else:
+        screens[operation_mode][1](selectedindex)
+
+def open_bluetooth():
+    show_list(["OFF","ON"], ["OFF","ON"], use_bluetooth)
+
+def choose_bluetooth(index):
+    global use_bluetooth
+    use_bluetooth = index
+    # scan in the background for as long as Bluetooth is on
+    if use_bluetooth==1:
+        bt_connections.start()
+    else:
+        bt_connections.stop()
+    go_main_screen()
+
+def connect_job(mac, name, outputs):
+    def job(report):
+        report("Connecting...")
+        if not connect_ble_device(mac):
+            return None
+        report("Waiting for port")
+        return wait_for_midi_port(name, outputs=outputs)
+    return job
+
+def open_midi_output():
+    show_list(*output_menu())
+
+def choose_midi_output(index):
+    def connected(port, error):
+        if port is None:
+            print(f"No MIDI port for {files[index]}")
+            return
+        midi_router.add(port)
+        refresh_device_list()
+    if pathes[index] == router.SYNTH or pathes[index] in port_watcher.outputs:
+        # route to this output too, or stop routing to it
+        midi_router.toggle(pathes[index])
+        refresh_device_list()
+    else:
+        # a BLE device: connect first, then route to its port
+        dispatcher.submit("Please Wait", connect_job(pathes[index], files[index], True), connected)
+
+def open_midi_input_list():
+    show_list(*input_menu())
+
+def choose_midi_input(index):
+    def connected(port, error):
+        if port is None:
+            print(f"No MIDI port for {files[index]}")
+            return
+        input_merger.add(port)
+        inputs_changed()
+    if pathes[index] == ALL_INPUTS:
+        input_merger.use_all()
+    elif pathes[index] in port_watcher.inputs:
+        # a plain port: add it to the merged inputs, or take it out again
+        input_merger.toggle(pathes[index])
+    else:
+        print(pathes[index])
+        print(files[index])
+        dispatcher.submit("Please Wait", connect_job(pathes[index], files[index], False), connected)
+        return
+    inputs_changed()
+
+def inputs_changed():
+    refresh_device_list()
+    try:
+        soundfont_pool.select_first_preset(0)
+    except ValueError as e:
+        print(e)
+    fs.set_reverb(0.9, 0.5, 0.8, 0.7)
+
+def open_soundfonts():
+    def job(report):
+        return soundfont_catalog.scan(os.readlink(directory + "/sf2"))
+    def scanned(paths, error):
+        if paths is None or operation_mode != "SOUND FONT":
+            return
+        names = [os.path.basename(path).replace(".sf2", "").replace("_", " ") for path in paths]
+        show_list(paths, names, paths.index(soundfontname) if soundfontname in paths else 0)
+    dispatcher.submit("Please Wait", job, scanned)
+
+def choose_soundfont(index):
+    load_soundfont(pathes[index])
+
+def load_soundfont(path):
+    def loaded(result, error):
+        global soundfontname
+        if error is None:
+            soundfontname = path
+        resetsynth()
+    dispatcher.submit("Loading...", lambda report: soundfont_pool.select(path), loaded)
+
+def open_midi_files():
+    show_list(*library.listing(library_view))
+
+def choose_midi_file(index):
+    midifilems = pathes[index]      # MIDI file path
+    play_midi_file(midifilems)
+    go_main_screen()
+
+def render_settings():
+    # renders read only the samples of the presets a file plays, as the live synth does
+    if load_presets_on_demand:
+        return dict(synth_settings, **{"synth.dynamic-sample-loading": 1})
+    return synth_settings
+
+def play_midi_file(path):
+    global now_playing
+    player.cancel()
+    audio_stream.stop()
+    now_playing = path
+    # every file starts at its own tempo and key, which is also what the render cache holds
+    player.set_tempo(1.0)
+    player.set_transpose(0)
+    if use_render_cache and [route.output for route in midi_router.routes] == [router.SYNTH]:
+        rendered = render_cache.lookup(path, soundfontname, render_settings())
+        if rendered is not None:
+            # next to no CPU; if the sound card is taken, synthesize live after all
+            audio_stream.play(rendered, lambda ok: ok or dispatcher.post(play_live, path))
+            return
+        try:
+            render_cache.render(path, soundfontname, render_settings())  # for the next time it is played
+        except OSError as e:
+            print("Cannot render:", e)
+    play_live(path)
+
+def preload_presets(messages):
+    # called by the player, ahead of playing a file: its presets are loaded before their program changes come
+    pool = soundfont_pool
+    if pool is not None and pool.dynamic:
+        pool.preload(soundfonts.presets_used(messages))
+
+def play_live(path, start=0.0):
+    # plays in the player's own thread so buttons keep working; the router
+    # sends to FluidSynth and the external ports alike
+    player.play(path, midi_router.send, start=start)
+
+def playlist_menu():
+    # saved playlists first, then every folder of the library
+    pathes = ["SHUFFLE"]
+    files = [("* " if shuffle_playlists else "") + "Shuffle"]
+    try:
+        saved = sorted(name for name in os.listdir(playlist_directory) if name.endswith(midilibrary.PLAYLIST_EXTENSION))
+    except OSError:
+        saved = []
+    for name in saved:
+        pathes.append(os.path.join(playlist_directory, name))
+        files.append(midilibrary.display_name(name, midilibrary.PLAYLIST_EXTENSION))
+    for folder in sorted(library.directories()):
+        pathes.append(folder)
+        files.append("All files" if folder == library.root else os.path.relpath(folder, library.root) + "/")
+    return pathes, files
+
+def open_playlists():
+    show_list(*playlist_menu())
+
+def choose_playlist(index):
+    global shuffle_playlists
+    path = pathes[index]
+    if path == "SHUFFLE":
+        shuffle_playlists = not shuffle_playlists
+        show_list(*playlist_menu(), keep_selection=True)
+        return
+    try:
+        paths = playlist_files(path)
+    except OSError as e:
+        print("Cannot read playlist:", e)
+        return
+    play_playlist(paths)
+    go_main_screen()
+
+def playlist_files(path):
+    # a saved playlist, or a folder of the library
+    if path.endswith(midilibrary.PLAYLIST_EXTENSION):
+        return midilibrary.read_playlist(path)
+    return library.files_below(path)
+
+def play_playlist(paths):
+    global now_playing
+    order = list(paths)
+    if shuffle_playlists:
+        random.shuffle(order)
+    if not order:
+        print("Playlist is empty")
+        return
+    player.cancel()
+    audio_stream.stop()
+    now_playing = order[0]
+    player.set_tempo(1.0)
+    player.set_transpose(0)
+    # always live: the player loads each next file while the one before plays, so
+    # there is no gap between them, which separate audio player processes would leave
+    player.play(order[0], midi_router.send, following=order[1:])
+
+def playback_menu():
+    if audio_stream.is_playing():
+        position, duration = audio_stream.position(), audio_stream.duration
+    elif player.is_playing():
+        position, duration = player.position, player.duration
+    else:
+        return ["STOPPED"], ["Nothing playing"]
+    paused = player.is_paused() or audio_stream.is_paused()
+    actions = ["POSITION", "BACK", "FORWARD", "PAUSE", "SLOWER", "FASTER", "DOWN", "UP", "NEXT", "STOP"]
+    labels = [
+        f"{midilibrary.format_duration(position)} / {midilibrary.format_duration(duration)}",
+        f"<< {seek_step} s",
+        f">> {seek_step} s",
+        "Resume" if paused else "Pause",
+        f"Slower ({player.tempo:.0%})",
+        f"Faster ({player.tempo:.0%})",
+        f"Transpose down ({player.transpose:+d})",
+        f"Transpose up ({player.transpose:+d})",
+        "Next file",
+        "Stop",
+    ]
+    return actions, labels
+
+def open_playback():
+    show_list(*playback_menu())
+
+def choose_playback(index):
+    playback_action(pathes[index])
+    # "POSITION" just refreshes the screen
+    show_list(*playback_menu(), keep_selection=True)
+
+def refresh_playback():
+    if operation_mode == "PLAYBACK":
+        show_list(*playback_menu(), keep_selection=True)
+
+def continue_live():
+    # rendered audio cannot be changed: carry on with live synthesis from the same spot
+    if audio_stream.is_playing():
+        position = audio_stream.position()
+        audio_stream.stop()
+        play_live(now_playing, position)
+
+def playback_action(action):
+    if action in ("BACK", "FORWARD", "SLOWER", "FASTER", "DOWN", "UP"):
+        continue_live()
+    if action == "BACK":
+        player.seek(player.position - seek_step)
+    elif action == "FORWARD":
+        player.seek(player.position + seek_step)
+    elif action == "PAUSE":
+        for p in (player, audio_stream):
+            if p.is_paused():
+                p.resume()
+            else:
+                p.pause()
+    elif action == "SLOWER":
+        player.set_tempo(max(0.25, player.tempo - tempo_step))
+    elif action == "FASTER":
+        player.set_tempo(min(4.0, player.tempo + tempo_step))
+    elif action == "DOWN":
+        player.set_transpose(player.transpose - 1)
+    elif action == "UP":
+        player.set_transpose(player.transpose + 1)
+    elif action == "NEXT":
+        if audio_stream.is_playing():
+            audio_stream.stop()
+        else:
+            player.skip()
+    elif action == "STOP":
+        player.cancel()
+        audio_stream.stop()
+
+def record_menu():
+    if recorder.recording:
+        return ["STOP", "TIME"], ["Stop and save", f"* Recording {midilibrary.format_duration(recorder.elapsed())}"]
+    return ["START"], ["Start recording"]
+
+def open_record():
+    show_list(*record_menu())
+
+def choose_record(index):
+    if pathes[index] == "START":
+        start_recording()
+    elif pathes[index] == "STOP":
+        stop_recording()
+    # "TIME" just refreshes the screen
+    show_list(*record_menu())
+
+def start_recording():
+    recorder.start()
+    midi_router.tap = recorder.record
+
+def stop_recording():
+    midi_router.tap = None
+    recorder.stop()
+
+def audio_menu():
+    # "* " marks the preset in use
+    pathes = list(governor.AUDIO_PRESETS)
+    files = [("* " if preset == synth_governor.preset else "") + preset.replace("-", " ").capitalize() for preset in pathes]
+    pathes += ["GOVERNOR", "STATUS"]
+    files += [("* " if synth_governor.enabled else "") + "Load governor", synth_governor.status().capitalize()]
+    return pathes, files
+
+def open_audio():
+    pathes, files = audio_menu()
+    show_list(pathes, files, pathes.index(synth_governor.preset))
+
+def choose_audio(index):
+    choice = pathes[index]
+    def restarted(result, error):
+        if operation_mode == "AUDIO":
+            show_list(*audio_menu(), keep_selection=True)
+    if choice == "GOVERNOR":
+        synth_governor.toggle()
+    elif choice in governor.AUDIO_PRESETS and choice != synth_governor.preset:
+        # buffer sizes are fixed when the audio driver starts
+        synth_governor.set_preset(choice)
+        dispatcher.submit("Restarting synth", restart_synth, restarted)
+        return
+    # "STATUS" just refreshes the screen
+    show_list(*audio_menu(), keep_selection=True)
+
+# screen -> (open it from the main screen, choose the highlighted entry)
+screens = {
+    "MIDI INPUT": (open_midi_input_list, choose_midi_input),
+    "MIDI OUTPUT": (open_midi_output, choose_midi_output),
+    "SOUND FONT": (open_soundfonts, choose_soundfont),
+    "MIDI FILE": (open_midi_files, choose_midi_file),
+    "PLAYLIST": (open_playlists, choose_playlist),
+    "PLAYBACK": (open_playback, choose_playback),
+    "RECORD": (open_record, choose_record),
+    "AUDIO": (open_audio, choose_audio),
+    "BLUETOOTH": (open_bluetooth, choose_bluetooth),
+}
+
+# Control socket (control.py). Queries only read, and answer straight from
+# the control thread (a SoundFont scan goes to the worker pool); commands
+# change what the menus show, so they run on the dispatcher thread, like
+# button presses, and are answered when they have run there.
+
+def handle_control(request):
+    cmd = request["cmd"]
+    if cmd in control_queries:
+        return control_queries[cmd](request)
+    if cmd in control_commands:
+        return dispatcher.call(control_commands[cmd], request)  # replied to once the dispatcher has run it
+    raise ValueError(f"unknown command {cmd!r}")
+
+def control_status(request):
+    rendered = audio_stream.is_playing()
+    if rendered:
+        playing, position, duration = now_playing, audio_stream.position(), audio_stream.duration
+    elif player.is_playing():
+        playing, position, duration = player.filepath, player.position, player.duration
+    else:
+        playing, position, duration = None, 0.0, 0.0
+    return {"screen": operation_mode, "busy": dispatcher.busy, "playing": playing, "rendered": rendered,
+            "position": round(position, 3), "duration": round(duration, 3),
+            "paused": player.is_paused() or audio_stream.is_paused(), "tempo": player.tempo,
+            "transpose": player.transpose, "recording": recorder.recording, "soundfont": soundfontname,
+            "audio_preset": synth_governor.preset,
+            "inputs": sorted(input_merger.opened), "outputs": [route.output for route in midi_router.routes]}
+
+def control_metrics(request):
+    # latencies in microseconds; "input" is from rtmidi's arrival timestamp until the synth and every port had it
+    pool = soundfont_pool
+    return {
+        "uptime": round(time.monotonic() - boot_time, 1),
+        "input": dict(midi_router.latency.snapshot(), ignored=live_input.ignored),
+        "playback": dict(player.lateness.snapshot(), end_drift_us=round(player.end_drift * 1e6, 1)),
+        "synth": {"load": synth_governor.load, "voices": synth_governor.voices, "stage": synth_governor.stage,
+                  "underruns": synth_governor.underruns, "governor": synth_governor.enabled},
+        "memory": dict(control.read_memory(), soundfonts=pool.used() if pool is not None else 0),
+        "threads": control.read_thread_states(),
+    }
+
+def control_reset(request):
+    midi_router.latency.reset()
+    live_input.ignored = 0
+    player.lateness.reset()
+    synth_governor.underruns = 0
+
+def control_inputs(request):
+    return {"merge_all": input_merger.merge_all,
+            "ports": [{"port": port, "open": port in input_merger.opened} for port in port_watcher.inputs]}
+
+def control_outputs(request):
+    return {"ports": [{"port": port, "active": midi_router.is_active(port)}
+                      for port in [router.SYNTH] + port_watcher.outputs]}
+
+def control_soundfonts(request):
+    # a scan parses new SoundFonts: on the worker pool, not the control thread
+    scan = lambda: {"soundfonts": soundfont_catalog.scan(os.readlink(directory + "/sf2")), "active": soundfontname}
+    return dispatcher.run_in_pool(scan)
+
+def control_play(request):
+    path = request["path"]
+    if not os.path.isfile(path):
+        raise ValueError(f"no such file: {path}")
+    play_midi_file(path)
+    refresh_playback()
+
+def control_queue(request):
+    # "paths", a list of MIDI files, or "path", a saved playlist or a library folder
+    paths = request["paths"] if "paths" in request else playlist_files(request["path"])
+    if not paths:
+        raise ValueError("nothing to play")
+    play_playlist(paths)
+    refresh_playback()
+    return {"queued": len(paths)}
+
+def control_playback(action):
+    def command(request):
+        playback_action(action)
+        refresh_playback()
+    return command
+
+def control_pause(request):
+    player.pause()
+    audio_stream.pause()
+    refresh_playback()
+
+def control_resume(request):
+    player.resume()
+    audio_stream.resume()
+    refresh_playback()
+
+def control_seek(request):
+    continue_live()
+    player.seek(float(request["position"]))
+    refresh_playback()
+
+def control_tempo(request):
+    continue_live()
+    player.set_tempo(max(0.25, min(4.0, float(request["tempo"]))))
+    refresh_playback()
+
+def control_transpose(request):
+    continue_live()
+    player.set_transpose(int(request["semitones"]))
+    refresh_playback()
+
+def control_record(request):
+    # "on": true starts, false stops and saves; without it, it toggles like the RECORD menu
+    if request.get("on", not recorder.recording):
+        start_recording()
+    else:
+        stop_recording()
+    if operation_mode == "RECORD":
+        show_list(*record_menu())
+    return {"recording": recorder.recording}
+
+def control_input(request):
+    # toggles a port like the MIDI INPUT menu; "ALL INPUTS" merges every port
+    port = request["port"]
+    if port == ALL_INPUTS:
+        input_merger.use_all()
+    elif port in port_watcher.inputs:
+        input_merger.toggle(port)
+    else:
+        raise ValueError(f"no such input: {port}")
+    inputs_changed()
+    return control_inputs(request)
+
+def control_output(request):
+    port = request["port"]
+    if port != router.SYNTH and port not in port_watcher.outputs:
+        raise ValueError(f"no such output: {port}")
+    midi_router.toggle(port)
+    refresh_device_list()
+    return control_outputs(request)
+
+def control_soundfont(request):
+    # replies at once; "status" shows the new SoundFont once it is loaded
+    path = request["path"]
+    if not os.path.isfile(path):
+        raise ValueError(f"no such file: {path}")
+    if dispatcher.busy is not None:
+        raise ValueError(f"busy: {dispatcher.busy}")
+    load_soundfont(path)
+    return {"loading": path}
+
+control_queries = {
+    "status": control_status,
+    "metrics": control_metrics,
+    "reset": control_reset,
+    "inputs": control_inputs,
+    "outputs": control_outputs,
+    "soundfonts": control_soundfonts,
+}
+control_commands = {
+    "play": control_play,
+    "queue": control_queue,
+    "stop": control_playback("STOP"),
+    "next": control_playback("NEXT"),
+    "pause": control_pause,
+    "resume": control_resume,
+    "seek": control_seek,
+    "tempo": control_tempo,
+    "transpose": control_transpose,
+    "record": control_record,
+    "input": control_input,
+    "output": control_output,
+    "soundfont": control_soundfont,
+}
+control_server = control.ControlServer(cache_directory + "/control.sock", handle_control)
+
 def midish_send(cmd,p):
     p.stdin.write(cmd + "\n")
     p.stdin.flush()
 
 def update_display():
-    draw.rectangle((0, 0, disp.width, disp.height), (0, 0, 0))
-    for i, line in enumerate(files):
-        if i >= selectedindex - 6:
-            xi = i
-            if selectedindex > 6:
-                xi = i - (selectedindex - 6)
-            if i == selectedindex:
-                draw.rectangle([10, 10 + (xi * 30), 230, 40 + (xi * 30)], fill=(255, 255, 255))
-                draw.text((10, 10 + (xi * 30)), line, font=font, fill=(0, 0, 0))
-            else:
-                draw.text((10, 10 + (xi * 30)), line, font=font, fill=(255, 255, 255))
-    disp.display(img)
-
-if check_for_updates(repo_path):
-    print("Restarting script to apply updates...")
-    os.execv(sys.executable, ['python'] + sys.argv)
-
-gpio_thread = threading.Thread(target=init_buttons)
-gpio_thread.start()
-
-midi_thread = threading.Thread(target=midi_listener)
-midi_thread.start()
-
-if display_type in ("square", "rect", "round"):
-    disp = st7789.ST7789(
-        height=135 if display_type == "rect" else 240,
-        rotation=0 if display_type == "rect" else 90,
-        port=0,
-        cs=st7789.BG_SPI_CS_FRONT,
-        dc=9,
-        backlight=13,
-        spi_speed_hz=80 * 1000 * 1000,
-        offset_left=0 if display_type == "square" else 40,
-        offset_top=53 if display_type == "rect" else 0,
-    )
-elif display_type == "dhmini":
-    disp = st7789.ST7789(
-        height=240,
-        width=320,
-        rotation=180,
-        port=0,
-        cs=1,
-        dc=9,
-        backlight=13,
-        spi_speed_hz=60 * 1000 * 1000,
-        offset_left=0,
-        offset_top=0,
-    )
-else:
-    print("Invalid display type!")
-
-disp.begin()
-WIDTH = disp.width
-HEIGHT = disp.height
-img = Image.new("RGB", (WIDTH, HEIGHT), color=(0, 0, 0))
-draw = ImageDraw.Draw(img)
-font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 20)
-
-# remove all known bluetooth devices...
-remove_all_devices()
-
-update_display()
-
-# Keep the script alive
-while True:
-    time.sleep(10)
+    # the renderer coalesces bursts, draws only the rows on screen and sends only those that changed
+    renderer.show(files, selectedindex, dispatcher.progress or scroll_label)
+
+def init_display():
+    global disp, renderer
+    disp, display_rotation = backends.Display(display_type)
+    font = backends.load_font(20)
+    renderer = display.Renderer(disp, font, display_rotation)
+
+def start_synth(report):
+    """Worker job: bring up FluidSynth and the default SoundFont."""
+    global fs, soundfont_pool
+    settings = dict(synth_settings, **synth_governor.synth_settings())
+    if load_presets_on_demand:
+        settings["synth.dynamic-sample-loading"] = 1
+    synth = timed("synth", lambda: backends.Synth(**settings))
+    timed("audio driver", synth.start, "alsa")
+    pool = soundfonts.SoundFontPool(synth, soundfont_catalog, soundfont_memory_budget, load_presets_on_demand)
+    timed("soundfont", pool.select, soundfontname)
+    live_input.attach(synth, pool)
+    synth_governor.attach(synth)
+    fs = synth
+    soundfont_pool = pool
+
+def restart_synth(report):
+    """Worker job: bring FluidSynth up again with the current audio preset."""
+    global fs, soundfont_pool
+    player.stop()
+    audio_stream.stop()
+    # both wait for a call into the old synth that is under way
+    live_input.detach()
+    synth_governor.detach()
+    if fs is not None:
+        fs.delete()
+    fs = soundfont_pool = None
+    start_synth(report)
+
+def synth_started(result, error):
+    print_startup_report()
+
+def update_in_background():
+    if timed("update check", check_for_updates, repo_path):
+        # don't cut off a song that is already playing
+        while player.is_playing() or audio_stream.is_playing():
+            time.sleep(1)
+        print("Restarting script to apply updates...")
+        os.execv(sys.executable, ['python'] + sys.argv)
+
+def main():
+    # the display comes first so the box shows a menu right after power-on
+    timed("display", init_display)
+    dispatcher.on_update = update_display
+    player.on_load = preload_presets
+    dispatcher.start()
+    update_display()
+    timed("buttons", init_buttons)
+
+    # presses during startup are deferred until the synth is ready
+    dispatcher.submit("Starting...", start_synth, synth_started)
+
+    timed("library", library.start)
+    library.on_change = library_changed
+    recorder.on_saved = library.add  # a recording shows up in MIDI FILE as soon as it is written
+    timed("midi ports", port_watcher.start)
+    timed("midi outputs", midi_router.sync)
+    port_watcher.add_listener(midi_ports_changed)
+    bt_discovery.on_change = bluetooth_devices_changed
+    # opens the inputs from last time; hot-plugged ones are (re)attached by the merger
+    timed("midi inputs", input_merger.sync)
+    try:
+        timed("control socket", control_server.start)
+    except OSError as e:
+        print("Cannot open the control socket:", e)
+
+    update_thread = threading.Thread(target=update_in_background, name="update", daemon=True)
+    update_thread.start()
+
+    # Keep the script alive
+    while True:
+        time.sleep(10)
+
+if __name__ == "__main__":
+    main()
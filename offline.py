@@ -0,0 +1,194 @@
+import hashlib, json, os, signal, subprocess, sys, threading, time, wave
+from concurrent.futures import ThreadPoolExecutor
+import backends, playback
+
+BLOCK_FRAMES = 4096   # frames rendered per get_samples() call
+TAIL_SECONDS = 2.0    # rendered after the last event, for releases and reverb
+
+def render_file(midi_path, soundfont, settings, catalog_path, wav_path):
+    """
+    Worker: render `midi_path` to a 16-bit stereo WAV at `wav_path`.
+
+    Uses a synth without an audio driver, pulled for samples as fast as the
+    CPU allows, and feeds it through the same SoundFont pool and decoder as
+    live playback, so the file sounds the same either way.
+    """
+    import livemidi, soundfonts
+    samplerate = int(settings.get("samplerate", 44100))
+    synth = backends.Synth(**settings)
+    # with dynamic sample loading, only the presets the file selects are read into memory
+    dynamic = bool(settings.get("synth.dynamic-sample-loading"))
+    pool = soundfonts.SoundFontPool(synth, soundfonts.Catalog(catalog_path), 0, dynamic)
+    pool.select(soundfont)
+    decoder = livemidi.LiveInput()
+    decoder.attach(synth, pool)
+    times, messages = playback.load_events(midi_path)
+    tmp = wav_path + f".{os.getpid()}.tmp"
+    rendered = 0
+    with wave.open(tmp, "wb") as out:
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(samplerate)
+        def render_until(frame):
+            nonlocal rendered
+            while rendered < frame:
+                frames = min(BLOCK_FRAMES, frame - rendered)
+                out.writeframes(synth.get_samples(frames).tobytes())
+                rendered += frames
+        for t, message in zip(times, messages):
+            render_until(int(t * samplerate))
+            decoder.dispatch(message)
+        render_until(int(((times[-1] if times else 0.0) + TAIL_SECONDS) * samplerate))
+    synth.delete()
+    os.replace(tmp, wav_path)
+    return wav_path
+
+def render_in_process(midi_path, soundfont, settings, catalog_path, wav_path):
+    """Run render_file() in a child process at the lowest CPU priority."""
+    # nice 19 keeps it out of the way of live synthesis on the same cores
+    command = ["nice", "-n", "19", sys.executable, os.path.abspath(__file__),
+               midi_path, soundfont, json.dumps(settings), catalog_path, wav_path]
+    result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        output = result.stdout.decode(errors="replace").strip().splitlines()
+        raise RuntimeError(output[-1] if output else f"exit status {result.returncode}")
+    return wav_path
+
+class RenderCache:
+    """
+    MIDI files rendered to audio ahead of time, so replaying them costs
+    next to no CPU.
+
+    Renders run in child processes, `workers` at a time (one per core if
+    not given), each a fresh interpreter that loads only what rendering
+    needs. The result is a
+    WAV in `directory`, named by a hash of the MIDI file's contents, the
+    SoundFont (path, size and mtime) and the synth settings, so any change
+    to them gives a new render instead of a stale one. The least recently
+    played renders are deleted once the directory grows past `budget` bytes.
+    """
+
+    def __init__(self, directory, catalog_path, budget, workers=None):
+        self.directory = directory
+        self.catalog_path = catalog_path
+        self.budget = budget
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._pending = {}   # key -> Future
+        self._lock = threading.Lock()
+
+    def key(self, midi_path, soundfont, settings):
+        digest = hashlib.sha1()
+        with open(midi_path, "rb") as f:
+            digest.update(f.read())
+        st = os.stat(soundfont)
+        digest.update(json.dumps([soundfont, st.st_size, st.st_mtime, settings], sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".wav")
+
+    def lookup(self, midi_path, soundfont, settings):
+        """Path of the rendered audio, or None if it has not been rendered yet."""
+        try:
+            path = self.path(self.key(midi_path, soundfont, settings))
+            os.utime(path)  # mark as recently played
+            return path
+        except OSError:
+            return None
+
+    def render(self, midi_path, soundfont, settings):
+        """Start rendering in the background unless it is cached or already running. Returns a Future or None."""
+        key = self.key(midi_path, soundfont, settings)
+        path = self.path(key)
+        with self._lock:
+            if key in self._pending or os.path.exists(path):
+                return self._pending.get(key)
+            if self._executor is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="render")
+            future = self._executor.submit(render_in_process, midi_path, soundfont, settings, self.catalog_path, path)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._rendered(key, f))
+        return future
+
+    def _rendered(self, key, future):
+        with self._lock:
+            del self._pending[key]
+        if future.exception() is not None:
+            print("Render failed:", future.exception())
+        else:
+            playback.trim_cache(self.directory, ".wav", self.budget)
+
+class AudioStream:
+    """
+    Plays a rendered WAV with the system's audio player in a child process,
+    with the same controls as playback.Player. `on_done(ok)` is called when
+    it ends by itself; ok is False when the player failed (for example when
+    the sound card is busy), so the caller can fall back to live synthesis.
+    """
+
+    def __init__(self):
+        self._process = None
+        self._paused = False
+        self._started = 0.0   # monotonic time playback started, moved on by pauses
+        self._paused_at = 0.0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def play(self, path, on_done=None):
+        self.stop()
+        with wave.open(path) as w:
+            self.duration = w.getnframes() / w.getframerate()
+        with self._lock:
+            self._process = subprocess.Popen(backends.audio_command(path), stdin=subprocess.DEVNULL,
+                                             stderr=subprocess.PIPE)
+            self._paused = False
+            self._started = time.monotonic()
+            threading.Thread(target=self._wait, args=(self._process, on_done), name="audio", daemon=True).start()
+
+    def _wait(self, process, on_done):
+        _out, err = process.communicate()
+        with self._lock:
+            stopped = process is not self._process
+            if not stopped:
+                self._process = None
+        if err:
+            print(err.decode(errors="replace").strip())
+        if not stopped and on_done is not None:
+            on_done(process.returncode == 0)
+
+    def stop(self):
+        with self._lock:
+            process, self._process = self._process, None
+        if process is not None and process.poll() is None:
+            if self._paused:
+                process.send_signal(signal.SIGCONT)
+            process.terminate()
+            process.wait()
+
+    def pause(self):
+        if self._process is not None and not self._paused:
+            self._process.send_signal(signal.SIGSTOP)
+            self._paused_at = time.monotonic()
+            self._paused = True
+
+    def resume(self):
+        if self._process is not None and self._paused:
+            self._process.send_signal(signal.SIGCONT)
+            self._started += time.monotonic() - self._paused_at
+            self._paused = False
+
+    def is_playing(self):
+        return self._process is not None
+
+    def position(self):
+        """Seconds into the file."""
+        return (self._paused_at if self._paused else time.monotonic()) - self._started
+
+    def is_paused(self):
+        return self._paused
+
+if __name__ == "__main__":
+    # offline.py <midi file> <soundfont> <settings json> <catalog> <wav file>
+    render_file(sys.argv[1], sys.argv[2], json.loads(sys.argv[3]), sys.argv[4], sys.argv[5])
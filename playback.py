@@ -0,0 +1,587 @@
+import array, bisect, hashlib, mmap, os, struct, threading, time, mido
+from concurrent.futures import ThreadPoolExecutor
+import livemidi
+
+# how long before a deadline we stop sleeping and start spinning
+SPIN_WINDOW = 0.002
+
+# event cache file: header, then count float64 times, count 4-byte events
+# (size, status, data1, data2), then the SysEx table: sysex_count + 1 uint32
+# offsets into the SysEx bytes that follow. A SysEx event has size 0 and its
+# table index in data1/data2. Native byte order, the cache never leaves the box.
+EVENTS_MAGIC = b"MEV1"
+EVENTS_HEADER = struct.Struct("<4sIII")  # magic, count, sysex_count, unused (keeps the times 8-aligned)
+
+def load_events(filepath):
+    """
+    Flatten a MIDI file into two parallel lists: absolute send times in seconds
+    and raw message bytes. Meta messages are dropped.
+    """
+    times = []
+    messages = []
+    now = 0.0
+    for msg in mido.MidiFile(filepath):
+        now += msg.time
+        if not msg.is_meta:
+            times.append(now)
+            messages.append(msg.bytes())
+    return times, messages
+
+class PackedMessages:
+    """The raw message bytes of a mapped event cache, by index."""
+
+    def __init__(self, buf, events, sysex_offsets, sysex_data):
+        self._buf = buf
+        self._events = events
+        self._sysex_offsets = sysex_offsets
+        self._sysex_data = sysex_data
+
+    def __len__(self):
+        return (self._sysex_offsets - self._events) // 4
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError("event index out of range")
+        o = self._events + 4 * i
+        size = self._buf[o]
+        if size:
+            return self._buf[o + 1:o + 1 + size]
+        index = self._buf[o + 2] | self._buf[o + 3] << 8
+        start, end = struct.unpack_from("<II", self._buf, self._sysex_offsets + 4 * index)
+        return self._buf[self._sysex_data + start:self._sysex_data + end]
+
+def write_events(path, times, messages):
+    """Write flattened events in the event cache format, atomically."""
+    packed = bytearray()
+    sysex_offsets = array.array("I", [0])
+    sysex_data = bytearray()
+    for message in messages:
+        if len(message) <= 3:
+            packed += bytes([len(message)]) + bytes(message) + bytes(3 - len(message))
+        else:
+            index = len(sysex_offsets) - 1
+            if index > 0xFFFF:
+                raise ValueError("too many SysEx messages for the event cache")
+            packed += bytes([0, message[0], index & 0xFF, index >> 8])
+            sysex_data += bytes(message)
+            sysex_offsets.append(len(sysex_data))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(EVENTS_HEADER.pack(EVENTS_MAGIC, len(times), len(sysex_offsets) - 1, 0))
+        f.write(array.array("d", times).tobytes())
+        f.write(packed)
+        f.write(sysex_offsets.tobytes())
+        f.write(sysex_data)
+    os.replace(tmp, path)
+
+def map_events(path):
+    """Memory-map an event cache file. Returns (times, messages) like load_events()."""
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buf) < EVENTS_HEADER.size:
+        raise ValueError(f"{path} is not an event cache")
+    magic, count, sysex_count, _unused = EVENTS_HEADER.unpack_from(buf)
+    events = EVENTS_HEADER.size + 8 * count
+    sysex_offsets = events + 4 * count
+    sysex_data = sysex_offsets + 4 * (sysex_count + 1)
+    if magic != EVENTS_MAGIC or len(buf) < sysex_data:
+        raise ValueError(f"{path} is not an event cache")
+    times = memoryview(buf)[EVENTS_HEADER.size:events].cast("d")
+    return times, PackedMessages(buf, events, sysex_offsets, sysex_data)
+
+class EventCache:
+    """
+    MIDI files flattened once into packed event arrays, then memory-mapped.
+
+    Parsing a file with mido builds a Message object per event and merges the
+    tracks in Python every time; a cached file is instead mapped in a few
+    microseconds, its times read straight from the page cache as float64 and
+    each message sliced out as raw bytes when it is played. Cache files are
+    named by the MIDI file's path, size and mtime, so an edited file is
+    parsed again; the least recently played ones are deleted once the
+    directory grows past `budget` bytes, which takes care of the stale
+    files edits leave behind.
+    """
+
+    def __init__(self, directory, budget=64 * 1024 * 1024):
+        self.directory = directory
+        self.budget = budget
+
+    def path(self, filepath):
+        st = os.stat(filepath)
+        key = hashlib.sha1(f"{os.path.abspath(filepath)}:{st.st_size}:{st.st_mtime}".encode()).hexdigest()
+        return os.path.join(self.directory, key + ".mev")
+
+    def load(self, filepath):
+        """(times, messages) of `filepath`, parsing it only when it is not cached yet."""
+        path = self.path(filepath)
+        try:
+            events = map_events(path)
+            os.utime(path)  # mark as recently played
+            return events
+        except (OSError, ValueError):
+            pass
+        times, messages = load_events(filepath)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_events(path, times, messages)
+            trim_cache(self.directory, ".mev", self.budget)
+        except (OSError, ValueError) as e:
+            print("Cannot cache events:", e)
+        return times, messages
+
+def trim_cache(directory, extension, budget):
+    """
+    Delete the `extension` files in a cache directory, least recently used
+    (oldest mtime) first, until the rest take at most `budget` bytes. Caches
+    touch a file with os.utime() whenever it is used.
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(extension):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _mtime, size, _path in entries)
+    # files that are open or mapped right now stay readable until they are closed
+    for _mtime, size, path in sorted(entries):
+        if total <= budget:
+            break
+        os.remove(path)
+        total -= size
+
+# channel state kept in seek snapshots: per channel 120 controllers, then these
+PROGRAM, BEND_LSB, BEND_MSB, PRESSURE = 120, 121, 122, 123
+CHANNEL_STATE = 124
+UNSET = 0xFF
+KEPT_ON_RESET = (0, 7, 10, 32, 91, 93)  # not touched by "reset all controllers" (RP-015)
+CONTROLLER_DEFAULTS = {7: 100, 10: 64}  # restored when a file has not set them yet
+SNAPSHOT_INTERVAL = 5.0  # seconds of music between snapshots
+
+def track_state(state, message):
+    """Apply a controller, program, pressure or pitch bend message to a snapshot state."""
+    status = message[0]
+    if not 0xB0 <= status < 0xF0 or len(message) < 2:
+        return
+    base = (status & 0x0F) * CHANNEL_STATE
+    kind = status & 0xF0
+    if kind == 0xB0 and len(message) >= 3:
+        control = message[1]
+        if control < 120:
+            state[base + control] = message[2]
+        elif control == 121:  # reset all controllers
+            for control in range(120):
+                if control not in KEPT_ON_RESET:
+                    state[base + control] = UNSET
+            state[base + BEND_LSB] = state[base + BEND_MSB] = state[base + PRESSURE] = UNSET
+    elif kind == 0xC0:
+        state[base + PROGRAM] = message[1]
+    elif kind == 0xD0:
+        state[base + PRESSURE] = message[1]
+    elif kind == 0xE0 and len(message) >= 3:
+        state[base + BEND_LSB] = message[1]
+        state[base + BEND_MSB] = message[2]
+
+def restore_messages(state):
+    """Messages that put all 16 channels into `state`, whatever they were in before."""
+    messages = []
+    for channel in range(16):
+        base = channel * CHANNEL_STATE
+        messages.append([0xB0 | channel, 121, 0])
+        for control in (0, 32):  # bank select goes before the program change
+            if state[base + control] != UNSET:
+                messages.append([0xB0 | channel, control, state[base + control]])
+        program = state[base + PROGRAM]
+        messages.append([0xC0 | channel, 0 if program == UNSET else program])
+        for control in range(1, 120):
+            value = state[base + control]
+            if value == UNSET:
+                value = CONTROLLER_DEFAULTS.get(control, UNSET)
+            if control != 32 and value != UNSET:
+                messages.append([0xB0 | channel, control, value])
+        if state[base + BEND_LSB] != UNSET:
+            messages.append([0xE0 | channel, state[base + BEND_LSB], state[base + BEND_MSB]])
+        if state[base + PRESSURE] != UNSET:
+            messages.append([0xD0 | channel, state[base + PRESSURE]])
+    return messages
+
+class Snapshots:
+    """
+    Channel state (controllers, programs, pitch bend, pressure) every
+    SNAPSHOT_INTERVAL seconds of a file, for seeking.
+
+    `build()` makes one pass over the events, in the player's loader thread
+    right after loading, and a seek before it is done replays from the start.
+    A seek starts from the snapshot before the target and only replays the
+    state messages of at most one interval, so it takes the same time
+    anywhere in the file.
+    """
+
+    def __init__(self, times, messages, interval=SNAPSHOT_INTERVAL):
+        self.times = times
+        self.messages = messages
+        self.interval = interval
+        self.indices = []  # index of the first event after each snapshot
+        self.states = []
+
+    def build(self):
+        state = bytearray([UNSET]) * (16 * CHANNEL_STATE)
+        next_time = 0.0
+        times = self.times
+        messages = self.messages
+        for i in range(len(times)):
+            while times[i] >= next_time:
+                self.states.append(bytes(state))
+                self.indices.append(i)
+                next_time += self.interval
+            track_state(state, messages[i])
+
+    def seek(self, position):
+        """Index of the first event at or after `position`, and the messages that restore the state there."""
+        target = bisect.bisect_left(self.times, position)
+        k = min(int(position / self.interval), len(self.indices) - 1)
+        if k < 0:  # nothing built yet
+            state = bytearray([UNSET]) * (16 * CHANNEL_STATE)
+            start = 0
+        else:
+            state = bytearray(self.states[k])
+            start = self.indices[k]
+        for i in range(start, target):
+            track_state(state, self.messages[i])
+        return target, restore_messages(state)
+
+class Player:
+    """
+    Plays pre-flattened MIDI events against a monotonic clock.
+
+    Every event is scheduled relative to a single origin, so a late wakeup or a
+    slow send only delays that one event - it never pushes the rest of the file
+    back. Waits sleep until SPIN_WINDOW before the deadline and spin the rest.
+
+    Files play on one playback thread that lives as long as the player, and
+    `play()` can be given the files to play after the first. While one file
+    plays, a loader thread reads the next and builds its snapshots, and the
+    next file starts on the clock where the last one ended, so a queue plays
+    without gaps. `on_load`, if set, is called with the messages of every
+    file before it plays, on the loader thread for all but the first.
+    Every job carries the generation it was started in, and `stop()` starts
+    a new one, so a job that is still loading when it is stopped or replaced
+    ends as soon as it looks, however long the load takes.
+
+    `seek()`, `set_tempo()` and `set_transpose()` work while playing: a seek
+    restores the channel state from the nearest snapshot, a tempo change
+    re-anchors the clock at the current position, and transposition is
+    applied per note in the send loop, remembering where each sounding note
+    went so its note off follows it.
+    """
+
+    def __init__(self, event_cache=None):
+        self.event_cache = event_cache
+        self.on_load = None
+        self._thread = None        # the playback thread, started by the first play()
+        self._loader = ThreadPoolExecutor(1, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._job = None           # (filepath, send, on_done, following, generation) for the playback thread
+        self._ready = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._playing = False
+        self._wake = threading.Event()
+        self._resume = threading.Event()
+        self._generation = 0       # a job plays while this is still the one it started in
+        self._paused = False
+        self._paused_at = 0.0
+        self._seek_to = None
+        self._following = iter(())  # files to play after the current one
+        self._upcoming = None      # Future of the next of them, loading
+        # (origin, anchor, tempo): song time `anchor` plays at wall clock time
+        # `origin` and runs `tempo` times as fast. Replaced as a whole under
+        # the lock, so the send loop reads it without one.
+        self._timebase = (0.0, 0.0, 1.0)
+        self._sounding = [-1] * 2048  # channel << 7 | note -> note it was sent as, -1 if unchanged
+        self._shifted = 0  # sounding notes that were sent transposed
+        self.tempo = 1.0
+        self.transpose = 0
+        self.filepath = None       # file being played
+        self.position = 0.0
+        self.duration = 0.0
+        self.lateness = livemidi.LatencyStats()  # how late each event went out, since playback started
+        self.end_drift = 0.0
+
+    def play(self, filepath, send, on_done=None, start=0.0, following=()):
+        """
+        Stop whatever is playing and start `filepath` (at `start` seconds) on
+        the playback thread, then the files of the iterable `following`, one
+        after another. `on_done` is called when the last one ends or playback
+        is stopped.
+        """
+        # no waiting for the job before: it runs out on the playback thread ahead of this one
+        self.cancel()
+        with self._lock:
+            self._seek_to = start if start > 0 else None
+            self.filepath = filepath
+            self.position = start
+            self._resume.set()
+            self._job = (filepath, send, on_done, iter(following), self._generation)
+            self._playing = True
+            self._idle.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._serve, name="player", daemon=True)
+                self._thread.start()
+            self._ready.set()
+
+    def stop(self, timeout=2):
+        """Stop, and wait up to `timeout` for the playback thread to let go of `send`."""
+        if not self._playing:
+            return
+        self.cancel()
+        if threading.current_thread() is not self._thread:
+            self._idle.wait(timeout)
+
+    def cancel(self):
+        """Stop without waiting: the job ends on the playback thread as soon as it looks, even mid-load."""
+        with self._lock:
+            self._generation += 1
+            self._paused = False  # stopping ends a pause too
+        self._resume.set()
+        self._wake.set()
+
+    def skip(self):
+        """End the current file now and go on with the next one, if there is one."""
+        if self._playing:
+            self.seek(self.duration)
+
+    def pause(self):
+        if self.is_playing() and not self._paused:
+            self._paused_at = time.monotonic()
+            self._paused = True
+            self._resume.clear()
+            self._wake.set()
+
+    def resume(self):
+        if self._paused:
+            self._paused = False
+            self._resume.set()
+
+    def is_playing(self):
+        return self._playing
+
+    def is_paused(self):
+        return self._paused
+
+    def seek(self, position):
+        """Continue playing from `position` seconds into the file."""
+        # clamped to the end once it is taken up: the file may still be loading
+        self._seek_to = max(0.0, position)
+        self.position = self._seek_to
+        self._wake.set()
+
+    def set_tempo(self, tempo):
+        """Play at `tempo` times the file's own speed from here on."""
+        with self._lock:
+            now = self._paused_at if self._paused else time.monotonic()
+            origin, anchor, old_tempo = self._timebase
+            self._timebase = (now, anchor + (now - origin) * old_tempo, tempo)
+            self.tempo = tempo
+        self._wake.set()
+
+    def set_transpose(self, semitones):
+        """Shift all notes outside the drum channel by `semitones` from the next note on."""
+        self.transpose = semitones
+
+    def _deadline(self, t):
+        origin, anchor, tempo = self._timebase
+        return origin + (t - anchor) / tempo
+
+    def _wait_until(self, t, send, generation):
+        """Wait for event time `t`. Returns False if playback was stopped, None for a seek."""
+        while True:
+            if self._generation != generation:
+                return False
+            if self._seek_to is not None:
+                return None
+            if self._paused:
+                all_notes_off(send)
+                self._resume.wait()
+                with self._lock:
+                    origin, anchor, tempo = self._timebase
+                    self._timebase = (origin + time.monotonic() - self._paused_at, anchor, tempo)
+                continue
+            remaining = self._deadline(t) - time.monotonic()
+            if remaining <= 0:
+                return True
+            if remaining > SPIN_WINDOW:
+                if self._upcoming is None:
+                    # load the next file from the first pause on, not while events are due
+                    self._upcoming = self._loader.submit(self._prepare, self._following)
+                    continue
+                if self._wake.wait(remaining - SPIN_WINDOW):
+                    self._wake.clear()
+            # else spin until the deadline
+
+    def _send(self, message, send):
+        """Send with transposition; only used while transposing or while transposed notes sound."""
+        status = message[0]
+        if 0x80 <= status < 0xB0 and status & 0x0F != 9 and len(message) >= 3:
+            key = (status & 0x0F) << 7 | message[1]
+            kind = status & 0xF0
+            if kind == 0x90 and message[2]:
+                note = message[1] + self.transpose
+                if not 0 <= note < 128:
+                    return
+                # a note struck again replaces where it went before, shifted or not
+                if self._sounding[key] >= 0:
+                    self._shifted -= 1
+                if note != message[1]:
+                    self._sounding[key] = note
+                    self._shifted += 1
+                else:
+                    self._sounding[key] = -1
+            elif kind == 0xA0:  # poly pressure follows its note
+                note = self._sounding[key]
+            else:  # note off goes where its note on went
+                note = self._sounding[key]
+                if note >= 0:
+                    self._sounding[key] = -1
+                    self._shifted -= 1
+            if note >= 0 and note != message[1]:
+                message = [status, note, message[2]]
+        send(message)
+
+    def _jump(self, position, snapshots, send):
+        position = min(position, self.duration)  # past the end simply finishes
+        all_notes_off(send)
+        self._sounding = [-1] * 2048
+        self._shifted = 0
+        index, messages = snapshots.seek(position)
+        for message in messages:
+            send(message)
+        with self._lock:
+            self._timebase = (time.monotonic(), position, self.tempo)
+        self.position = position
+        return index
+
+    def _serve(self):
+        # the playback thread: plays one job after another, never exits
+        while True:
+            self._ready.wait()
+            with self._lock:
+                job, self._job = self._job, None
+                self._ready.clear()
+            if job is not None:
+                self._run(*job)
+            with self._lock:
+                if self._job is None:  # unless on_done started something new
+                    self._playing = False
+                    self._idle.set()
+
+    def _load(self, filepath):
+        if self.event_cache is not None:
+            times, messages = self.event_cache.load(filepath)
+        else:
+            times, messages = load_events(filepath)
+        if self.on_load is not None:
+            self.on_load(messages)
+        return times, messages
+
+    def _prepare(self, following):
+        """Loader job: the next file of `following` that loads, as (filepath, times, messages, snapshots, reset), or None."""
+        for filepath in following:
+            try:
+                times, messages = self._load(filepath)
+            except Exception as e:
+                print(f"Cannot play {filepath}: {e}")
+                continue
+            snapshots = Snapshots(times, messages)
+            snapshots.build()  # also pages a mapped cache file in
+            # nothing carries over from the file before: all channels go to the state at 0:00
+            reset = snapshots.seek(0.0)[1]
+            return filepath, times, messages, snapshots, reset
+        return None
+
+    def _run(self, filepath, send, on_done, following, generation):
+        self._following = following
+        try:
+            times, messages = self._load(filepath)
+            if self._generation != generation:
+                return  # stopped or replaced while loading
+            snapshots = Snapshots(times, messages)
+            self._loader.submit(snapshots.build)
+            self.lateness.reset()
+            self.end_drift = 0.0
+            with self._lock:
+                self._timebase = (time.monotonic(), 0.0, self.tempo)
+            while True:
+                self._upcoming = None
+                end = self._play_events(times, messages, snapshots, send, generation)
+                if end is None:
+                    break
+                if self._upcoming is None:  # over before it ever waited
+                    self._upcoming = self._loader.submit(self._prepare, following)
+                prepared = self._upcoming.result()
+                if self._generation != generation:
+                    break
+                if prepared is None:
+                    # printed only now, it takes longer than the gap between two files allows
+                    print(f"Playback finished, max late {self.lateness.max_latency * 1000:.2f} ms, end drift {self.end_drift * 1000:.2f} ms")
+                    break
+                filepath, times, messages, snapshots, reset = prepared
+                # on the clock the next file starts where this one ended, not when it was loaded
+                with self._lock:
+                    self._timebase = (end, 0.0, self.tempo)
+                for message in reset:
+                    send(message)
+                self.filepath = filepath
+                self.position = 0.0
+        except Exception as e:
+            print("Playback error:", e)
+        finally:
+            if self._upcoming is not None:
+                self._upcoming.cancel()
+            if on_done is not None:
+                on_done()
+
+    def _play_events(self, times, messages, snapshots, send, generation):
+        """Play one file from the current timebase. Returns the deadline of its last event, or None if stopped."""
+        count = len(times)
+        self.duration = times[count - 1] if count else 0.0
+        self._sounding = [-1] * 2048
+        self._shifted = 0
+        late = 0.0
+        i = 0
+        monotonic = time.monotonic
+        count_late = self.lateness.add
+        while i < count:
+            t = times[i]
+            origin, anchor, tempo = self._timebase
+            deadline = origin + (t - anchor) / tempo
+            # events that are already due go straight out, several often share a time
+            if monotonic() < deadline or self._generation != generation or self._paused or self._seek_to is not None:
+                ready = self._wait_until(t, send, generation)
+                if ready is None:
+                    position, self._seek_to = self._seek_to, None
+                    i = self._jump(position, snapshots, send)
+                    continue
+                if not ready:
+                    all_notes_off(send)
+                    return None
+                deadline = self._deadline(t)
+            if self.transpose or self._shifted:
+                self._send(messages[i], send)
+            else:
+                send(messages[i])
+            self.position = t
+            late = monotonic() - deadline
+            count_late(late)
+            i += 1
+        self.end_drift = late
+        # the clock carries on from the last event, unless a seek went past it
+        return max(self._deadline(self.duration), monotonic() - SPIN_WINDOW)
+
+def all_notes_off(send):
+    for channel in range(16):
+        send([0xB0 | channel, 64, 0])   # sustain off
+        send([0xB0 | channel, 123, 0])  # all notes off
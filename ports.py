@@ -0,0 +1,189 @@
+import json, os, re, threading, backends
+
+POLL_INTERVAL = 0.25
+
+# inputs that are never merged in on their own: loopbacks and our own ports
+IGNORED_INPUTS = ("Midi Through", "RtMidi", "FLUID Synth")
+
+# ALSA appends "client:port" numbers, which change when a device is replugged
+CLIENT_PORT_RE = re.compile(r"\s+\d+:\d+$")
+
+def port_key(port):
+    """Port name without the ALSA client:port numbers, stable across replugs."""
+    return CLIENT_PORT_RE.sub("", port)
+
+class PortWatcher:
+    """
+    Watches the rtmidi port lists and reports ports appearing and disappearing.
+
+    One MidiIn/MidiOut pair is kept for listing, and the lists are diffed on
+    a short interval; listeners are called with (added, removed) input and
+    output port names, and `wait_for()` wakes as soon as a matching port shows
+    up instead of sleeping a fixed time.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.inputs = []
+        self.outputs = []
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._lister_in = backends.MidiIn()
+        self._lister_out = backends.MidiOut()
+        self._thread = None
+
+    def start(self):
+        self.poll()
+        self._thread = threading.Thread(target=self._run, name="ports", daemon=True)
+        self._thread.start()
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def poll(self):
+        """Re-read the port lists and notify listeners if they changed."""
+        inputs = self._lister_in.get_ports()
+        outputs = self._lister_out.get_ports()
+        with self._cond:
+            added_in = [p for p in inputs if p not in self.inputs]
+            removed_in = [p for p in self.inputs if p not in inputs]
+            added_out = [p for p in outputs if p not in self.outputs]
+            removed_out = [p for p in self.outputs if p not in outputs]
+            self.inputs = inputs
+            self.outputs = outputs
+            changed = added_in or removed_in or added_out or removed_out
+            if changed:
+                self._cond.notify_all()
+        if changed:
+            for listener in list(self._listeners):
+                try:
+                    listener(added_in, removed_in, added_out, removed_out)
+                except Exception as e:
+                    print("Port listener failed:", e)
+        return changed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.interval)
+            self.poll()
+
+    def find(self, port_name_substring, outputs=False):
+        for p in (self.outputs if outputs else self.inputs):
+            if port_name_substring.lower() in p.lower():
+                return p
+        return None
+
+    def wait_for(self, port_name_substring, timeout=10, outputs=False):
+        """
+        Wait until a MIDI port containing `port_name_substring` appears.
+        Returns the full port name or None if timeout expires.
+        """
+        with self._cond:
+            found = self._cond.wait_for(lambda: self.find(port_name_substring, outputs), timeout)
+        return found or None
+
+class InputMerger:
+    """
+    Keeps several MIDI input ports open at once and merges them into one
+    stream for the synth.
+
+    Every port gets its own rtmidi MidiIn whose callback is `callback`
+    itself, so events from a keyboard and a pad controller reach the synth
+    straight from their rtmidi threads, with no queue or thread hop in
+    between; `port_data(port)` gives the value passed along as the
+    callback's data. In "all inputs" mode every port except IGNORED_INPUTS
+    is used, otherwise only the ones chosen. Ports are matched by name
+    without the ALSA client numbers and the choice is kept in
+    `settings_path`, so an unplugged device is reattached as soon as the
+    PortWatcher sees it again, also after a restart.
+    """
+
+    def __init__(self, watcher, callback, settings_path, port_data=None):
+        self.watcher = watcher
+        self.callback = callback
+        self.settings_path = settings_path
+        self.port_data = port_data
+        self.merge_all = True
+        self.wanted = []      # port keys used when merge_all is off
+        self.opened = {}      # port name -> MidiIn
+        self._lock = threading.RLock()
+        try:
+            with open(settings_path) as f:
+                settings = json.load(f)
+            self.merge_all = settings["merge_all"]
+            self.wanted = settings["wanted"]
+        except (OSError, ValueError, KeyError):
+            pass
+        watcher.add_listener(self._ports_changed)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.settings_path), exist_ok=True)
+        tmp = self.settings_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"merge_all": self.merge_all, "wanted": self.wanted}, f)
+        os.replace(tmp, self.settings_path)
+
+    def is_wanted(self, port):
+        if self.merge_all:
+            return not any(ignored in port for ignored in IGNORED_INPUTS)
+        return port_key(port) in self.wanted
+
+    def use_all(self):
+        with self._lock:
+            self.merge_all = True
+            self._save()
+            self.sync()
+
+    def toggle(self, port):
+        """Add `port` to the merged inputs, or remove it if it is already in."""
+        with self._lock:
+            if self.merge_all:
+                # start from what is playing now rather than from nothing
+                self.merge_all = False
+                self.wanted = [port_key(p) for p in self.opened]
+            key = port_key(port)
+            if key in self.wanted:
+                self.wanted.remove(key)
+            else:
+                self.wanted.append(key)
+            self._save()
+            self.sync()
+
+    def add(self, port):
+        with self._lock:
+            if not self.is_wanted(port):
+                self.toggle(port)
+
+    def sync(self):
+        """Open the wanted ports that are present and close everything else."""
+        with self._lock:
+            present = self.watcher.inputs
+            for port in list(self.opened):
+                if port not in present or not self.is_wanted(port):
+                    self._close(port)
+            for port in present:
+                if port not in self.opened and self.is_wanted(port):
+                    self._open(port)
+
+    def _open(self, port):
+        midi_in = backends.MidiIn()
+        try:
+            midi_in.open_port(midi_in.get_ports().index(port))
+        except Exception as e:  # gone again, or busy
+            print(f"Cannot open MIDI input {port}: {e}")
+            return
+        midi_in.ignore_types(sysex=False)
+        midi_in.set_callback(self.callback, self.port_data(port) if self.port_data else None)
+        self.opened[port] = midi_in
+        print(f"Using MIDI input: {port}")
+
+    def _close(self, port):
+        midi_in = self.opened.pop(port)
+        midi_in.cancel_callback()
+        midi_in.close_port()
+        print(f"Closed MIDI input: {port}")
+
+    def _ports_changed(self, added_in, removed_in, added_out, removed_out):
+        if added_in or removed_in:
+            self.sync()
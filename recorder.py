@@ -0,0 +1,187 @@
+import array, os, struct, threading, time
+from livemidi import DATA_LENGTH, REALTIME, SYSEX, SYSEX_END
+
+RING_EVENTS = 16384     # messages the ring holds between two flushes, a power of two
+FLUSH_INTERVAL = 0.25   # seconds between drains of the ring
+YIELD_EVERY = 256       # messages encoded between GIL releases when saving
+TICKS_PER_BEAT = 480
+TEMPO = 500000          # 120 BPM, so a tick is a fixed 1/960 s
+TICKS_PER_SECOND = TICKS_PER_BEAT * 1e6 / TEMPO
+
+def split_messages(raw, running):
+    """
+    The complete messages in one raw input message (bytes), as byte strings,
+    and the running status after it. Like LiveInput.dispatch(), data bytes
+    without a status byte reuse `running`, so packets of several events
+    become one message each.
+    """
+    end = len(raw)
+    if end == 0:
+        return [], running
+    status = raw[0]
+    if status < 0x80:
+        status = running
+        i = 0
+    elif status < SYSEX:
+        running = status
+        i = 1
+    elif status == SYSEX:
+        return ([raw] if raw[end - 1] == SYSEX_END else []), 0
+    else:
+        return [], (running if status >= REALTIME else 0)
+    length = DATA_LENGTH.get(status & 0xF0) if status else None
+    if length is None:
+        return [], running
+    head = bytes([status])
+    return [head + raw[j:j + length] for j in range(i, end - length + 1, length)], running
+
+def variable_length(value):
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(0x80 | value & 0x7F)
+        value >>= 7
+    return bytes(reversed(data))
+
+def write_midi_file(path, times, messages, start):
+    """
+    Write recorded raw messages, with their perf_counter times, as a type 0
+    standard MIDI file; `start` is time 0. Encoded by hand rather than
+    through mido objects, and with the GIL given up every YIELD_EVERY
+    messages, so saving while someone plays does not hold up their input.
+    """
+    track = bytearray(b"\x00\xff\x51\x03" + TEMPO.to_bytes(3, "big"))  # set tempo
+    running = 0
+    last = 0
+    for k, t in enumerate(times):
+        if k % YIELD_EVERY == 0:
+            time.sleep(0)
+        complete, running = split_messages(bytes(messages[k]), running)
+        tick = round((t - start) * TICKS_PER_SECOND)
+        for raw in complete:
+            track += variable_length(tick - last)
+            last = tick
+            if raw[0] == SYSEX:
+                track.append(SYSEX)
+                track += variable_length(len(raw) - 1)
+                track += raw[1:]
+            else:
+                track += raw
+    track += b"\x00\xff\x2f\x00"  # end of track
+    with open(path, "wb") as f:
+        f.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, TICKS_PER_BEAT))
+        f.write(b"MTrk" + struct.pack(">I", len(track)))
+        f.write(track)
+
+class Recorder:
+    """
+    Records live input to a standard MIDI file in `directory`.
+
+    `record()` is the router's tap: it is called with every live input
+    message once it has gone out, on the thread of the port it came in on.
+    All it does is put the message rtmidi made and a timestamp into a ring
+    of slots that is allocated once, so it allocates nothing, does no I/O
+    and holds its lock only for those two stores. If the ring fills up
+    between two flushes, messages are counted in `dropped` instead of
+    waiting.
+
+    A flush thread copies the ring out every FLUSH_INTERVAL and, when
+    recording stops, writes it as a type 0 file at 120 BPM (so ticks are
+    plain time) and calls `on_saved(path)` from that thread.
+    """
+
+    def __init__(self, directory, capacity=RING_EVENTS):
+        self.directory = directory
+        self.capacity = capacity
+        self.on_saved = None
+        self.recording = False
+        self.started = 0.0       # perf_counter when recording started
+        self.events = 0          # messages drained from the ring so far
+        self.dropped = 0
+        self._mask = capacity - 1
+        self._times = array.array("d", [0.0]) * capacity
+        self._messages = [None] * capacity
+        self._write = 0          # messages ever put in the ring...
+        self._read = 0           # ...and taken out of it
+        self._log_times = None   # everything drained so far, while recording
+        self._log_messages = None
+        self._clock = time.perf_counter
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.recording:
+            return
+        if self._thread is not None:
+            self._thread.join()  # the last recording is still being saved
+        self._write = self._read = 0
+        self.events = 0
+        self.dropped = 0
+        self._stop.clear()
+        self.started = self._clock()
+        self.recording = True
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop recording; the file is written in the background."""
+        if self.recording:
+            self.recording = False
+            self._stop.set()
+
+    def elapsed(self):
+        return self._clock() - self.started if self.recording else 0.0
+
+    def record(self, message):
+        with self._lock:
+            write = self._write
+            if write - self._read > self._mask:
+                self.dropped += 1
+                return
+            slot = write & self._mask
+            self._times[slot] = self._clock()
+            self._messages[slot] = message
+            self._write = write + 1
+
+    def _drain(self):
+        # slots between _read and _write are only written again once _read has moved past them
+        with self._lock:
+            read, write = self._read, self._write
+        first = read & self._mask
+        last = first + write - read
+        # one or two slices of the ring, copied out in C: the flush keeps the GIL for microseconds
+        for lo, hi in ((first, min(last, self.capacity)), (0, last - self.capacity)):
+            if hi > lo:
+                self._log_times.extend(self._times[lo:hi])
+                self._log_messages.extend(self._messages[lo:hi])
+                self._messages[lo:hi] = [None] * (hi - lo)
+        self.events += write - read
+        with self._lock:
+            self._read = write
+
+    def _run(self):
+        name = time.strftime("recording_%Y-%m-%d_%H-%M-%S.mid")
+        self._log_times = array.array("d")
+        self._log_messages = []
+        while not self._stop.wait(FLUSH_INTERVAL):
+            self._drain()
+        self._drain()
+        if self.events == 0:
+            print("Nothing recorded")
+            return
+        path = os.path.join(self.directory, name)
+        # written under a hidden name, so the library only ever sees the whole file
+        tmp = os.path.join(self.directory, "." + name + ".tmp")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_midi_file(tmp, self._log_times, self._log_messages, self.started)
+            os.replace(tmp, path)
+        except OSError as e:
+            print("Cannot save recording:", e)
+            return
+        finally:
+            self._log_times = self._log_messages = None
+        print(f"Recorded {self.events} messages to {path}" + (f", {self.dropped} dropped" if self.dropped else ""))
+        if self.on_saved is not None:
+            self.on_saved(path)
@@ -0,0 +1,193 @@
+import json, os, threading, backends, livemidi
+from ports import port_key
+
+SYNTH = "FLUIDSYNTH"
+
+# velocity curves by name: exponent applied to velocity / 127
+VELOCITY_CURVES = {"linear": 1.0, "soft": 0.6, "hard": 1.6}
+
+def velocity_table(curve):
+    """128 output velocities for `curve`: a name, an exponent or "fixed:<velocity>"."""
+    if isinstance(curve, str) and curve.startswith("fixed:"):
+        fixed = max(1, min(127, int(curve[6:])))
+        return [0] + [fixed] * 127
+    exponent = VELOCITY_CURVES.get(curve, curve)
+    # velocity 0 stays a note off, every other velocity stays a note on
+    return [0] + [max(1, min(127, round(127 * (v / 127) ** exponent))) for v in range(1, 128)]
+
+class Route:
+    """
+    One output of the router with its filters, compiled into lookup tables.
+
+    `channels` is a list of channel numbers (1-16) to pass, or None for all;
+    `transpose` shifts notes and poly pressure by semitones, dropping notes
+    that fall off the keyboard; `velocity` is a curve for velocity_table().
+    Messages that need no change are passed on as the very object that came
+    in; only transposed or re-curved notes are rebuilt, as 3 raw bytes.
+    """
+
+    def __init__(self, output, channels=None, transpose=0, velocity="linear", enabled=True):
+        self.output = output
+        self.channels = channels
+        self.transpose = transpose
+        self.velocity = velocity
+        self.enabled = enabled
+        self.send = None  # set when the output is opened
+        self.passes = [channels is None or c + 1 in channels for c in range(16)]
+        self.notes = [n + transpose if 0 <= n + transpose < 128 else -1 for n in range(128)]
+        self.velocities = velocity_table(velocity)
+        self.remap = transpose != 0 or self.velocities != list(range(128))
+
+    def settings(self):
+        return {"output": self.output, "channels": self.channels, "transpose": self.transpose,
+                "velocity": self.velocity, "enabled": self.enabled}
+
+    def forward(self, message):
+        status = message[0]
+        if 0x80 <= status < 0xF0:
+            if not self.passes[status & 0x0F]:
+                return
+            if self.remap and status < 0xB0 and len(message) >= 3:  # note off, note on, poly pressure
+                note = self.notes[message[1]]
+                if note < 0:
+                    return
+                velocity = self.velocities[message[2]] if status & 0xF0 == 0x90 else message[2]
+                message = [status, note, velocity]
+        self.send(message)
+
+class Router:
+    """
+    MIDI thru: forwards every live input message to a set of outputs.
+
+    Outputs are FluidSynth (`synth_send`), and rtmidi output ports, which
+    includes BLE-MIDI devices once they are connected. Messages stay raw
+    bytes from rtmidi callback to output, nothing is decoded into mido
+    messages, and `callback()` is the input merger's rtmidi callback, so a
+    message is on its way out from the port's own thread with no queue in
+    between. `latency` measures the time from arrival until every output has
+    it, and `tap`, if set, is then handed the message too (the recorder).
+
+    The routes, with their filters, are kept in `settings_path`. Port routes
+    are matched by name without the ALSA client numbers and are reopened
+    when their device comes back. File playback goes to the same outputs
+    through `send()`, without the live-input filters.
+    """
+
+    def __init__(self, watcher, synth_send, settings_path):
+        self.watcher = watcher
+        self.synth_send = synth_send
+        self.settings_path = settings_path
+        self.configured = [Route(SYNTH)]
+        self.routes = ()         # open routes; replaced, never changed in place
+        self.latency = livemidi.LatencyStats()
+        self.tap = None
+        self._ports = {}         # output name -> (MidiOut, send)
+        self._lock = threading.RLock()
+        try:
+            with open(settings_path) as f:
+                self.configured = [Route(**settings) for settings in json.load(f)["routes"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        watcher.add_listener(self._ports_changed)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.settings_path), exist_ok=True)
+        tmp = self.settings_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"routes": [route.settings() for route in self.configured]}, f, indent=1)
+        os.replace(tmp, self.settings_path)
+
+    def callback(self, message_data, clock=None):
+        """rtmidi input callback: forward to every route, then record the latency and pass it to the tap."""
+        message, delta = message_data
+        if not message:
+            return
+        for route in self.routes:
+            route.forward(message)
+        self.latency.record(delta, clock)
+        tap = self.tap
+        if tap is not None:
+            tap(message)
+
+    def send(self, message):
+        """Send to every open output unfiltered, for file playback."""
+        for route in self.routes:
+            route.send(message)
+
+    def route(self, output):
+        key = output if output == SYNTH else port_key(output)
+        for route in self.configured:
+            if route.output == key:
+                return route
+        return None
+
+    def is_active(self, output):
+        route = self.route(output)
+        return route is not None and route in self.routes
+
+    def toggle(self, output):
+        """Start routing to `output`, or stop if it is already routed to."""
+        with self._lock:
+            route = self.route(output)
+            if route is None:
+                self.configured.append(Route(output if output == SYNTH else port_key(output)))
+            else:
+                route.enabled = not route.enabled
+            self._save()
+            self.sync()
+
+    def add(self, output):
+        with self._lock:
+            route = self.route(output)
+            if route is None or not route.enabled:
+                self.toggle(output)
+
+    def sync(self):
+        """Open the outputs of enabled routes that are present, close the rest."""
+        with self._lock:
+            present = {port_key(port): port for port in self.watcher.outputs}
+            for output in list(self._ports):
+                route = self.route(output)
+                if route is None or not route.enabled or output not in present:
+                    self._close(output)
+            routes = []
+            # a route's send is left alone once set: input threads may be using it right now
+            for route in self.configured:
+                if not route.enabled:
+                    continue
+                if route.output == SYNTH:
+                    route.send = self.synth_send
+                elif route.output in self._ports or (route.output in present and self._open(route.output, present[route.output])):
+                    route.send = self._ports[route.output][1]
+                else:
+                    continue
+                routes.append(route)
+            self.routes = tuple(routes)
+
+    def _open(self, output, port):
+        midi_out = backends.MidiOut()
+        try:
+            midi_out.open_port(midi_out.get_ports().index(port))
+        except Exception as e:  # gone again, or busy
+            print(f"Cannot open MIDI output {port}: {e}")
+            return False
+        self._ports[output] = (midi_out, self._locked_send(midi_out))
+        print(f"Using MIDI output: {port}")
+        return True
+
+    def _close(self, output):
+        self._ports.pop(output)[0].close_port()
+        print(f"Closed MIDI output: {output}")
+
+    def _locked_send(self, midi_out):
+        # input threads and the player share the port; rtmidi's encoder is not thread safe
+        lock = threading.Lock()
+        send_message = midi_out.send_message
+        def send(message):
+            with lock:
+                send_message(message)
+        return send
+
+    def _ports_changed(self, added_in, removed_in, added_out, removed_out):
+        if added_out or removed_out:
+            self.sync()
@@ -0,0 +1,381 @@
+import os, json, mmap, struct, threading
+from collections import OrderedDict
+
+PHDR_RECORD = struct.Struct("<20sHHHIII")  # name, preset, bank, bag index, library, genre, morphology
+BAG_RECORD = struct.Struct("<HH")          # generator index, modulator index (pbag and ibag)
+GEN_RECORD = struct.Struct("<HH")          # generator, amount (pgen and igen)
+INST_RECORD = struct.Struct("<20sH")       # name, bag index
+SHDR_RECORD = struct.Struct("<20sIIIIIBbHH")  # name, start, end, loop start, loop end, rate, pitch, correction, link, type
+GEN_INSTRUMENT = 41
+GEN_SAMPLE_ID = 53
+
+def _chunks(buf, start, end):
+    """Yield (id, data offset, size) for the RIFF chunks between start and end."""
+    offset = start
+    while offset + 8 <= end:
+        ckid = bytes(buf[offset:offset + 4])
+        size = struct.unpack_from("<I", buf, offset + 4)[0]
+        yield ckid, offset + 8, size
+        offset += 8 + size + (size & 1)
+
+def pdta_chunks(buf):
+    """Map of sub-chunk id -> (offset, size) from the pdta list of an SF2 file."""
+    if bytes(buf[0:4]) != b"RIFF" or bytes(buf[8:12]) != b"sfbk":
+        raise ValueError("not a SoundFont 2 file")
+    for ckid, offset, size in _chunks(buf, 12, len(buf)):
+        if ckid == b"LIST" and bytes(buf[offset:offset + 4]) == b"pdta":
+            return {ckid: (o, s) for ckid, o, s in _chunks(buf, offset + 4, offset + size)}
+    raise ValueError("SoundFont has no preset data")
+
+def sample_data_size(buf):
+    """Bytes of sample data (the sdta list) in an SF2 file."""
+    for ckid, offset, size in _chunks(buf, 12, len(buf)):
+        if ckid == b"LIST" and bytes(buf[offset:offset + 4]) == b"sdta":
+            return size
+    return 0
+
+def read_presets(path):
+    """
+    Return sorted [bank, program, name] lists for every preset in an SF2 file.
+    Only the preset header chunk is touched; the sample data is never read.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        offset, size = pdta_chunks(buf)[b"phdr"]
+        presets = []
+        # the last record is the terminal "EOP" entry
+        for i in range(size // PHDR_RECORD.size - 1):
+            name, program, bank, _bag, _lib, _genre, _morph = PHDR_RECORD.unpack_from(buf, offset + i * PHDR_RECORD.size)
+            name = name.split(b"\0", 1)[0].decode("latin-1").strip()
+            presets.append([bank, program, name])
+    presets.sort()
+    return presets
+
+def _zones(buf, chunks, header, bag_ckid, gen_ckid, generator):
+    """For each record of the `header` chunk (phdr or inst): the `generator` amounts of its zones."""
+    hdr_offset, hdr_size = chunks[header]
+    record = PHDR_RECORD if header == b"phdr" else INST_RECORD
+    bag_offset, _ = chunks[bag_ckid]
+    gen_offset, gen_size = chunks[gen_ckid]
+    gen_count = gen_size // GEN_RECORD.size
+    bag_index = lambda i: record.unpack_from(buf, hdr_offset + i * record.size)[-4 if header == b"phdr" else 1]
+    gen_index = lambda b: BAG_RECORD.unpack_from(buf, bag_offset + b * BAG_RECORD.size)[0]
+    zones = []
+    for i in range(hdr_size // record.size - 1):  # the last record is the terminal one
+        amounts = []
+        for b in range(bag_index(i), bag_index(i + 1)):
+            for g in range(gen_index(b), min(gen_index(b + 1), gen_count)):
+                oper, amount = GEN_RECORD.unpack_from(buf, gen_offset + g * GEN_RECORD.size)
+                if oper == generator:
+                    amounts.append(amount)
+        zones.append(amounts)
+    return zones
+
+def read_preset_sizes(path):
+    """
+    Return sorted [bank, program, bytes] lists: the sample data each preset
+    plays from, which is what FluidSynth reads when it loads the preset on
+    its own. Only the preset data is parsed, from preset through instrument
+    zones to the sample headers.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        chunks = pdta_chunks(buf)
+        instruments = _zones(buf, chunks, b"inst", b"ibag", b"igen", GEN_SAMPLE_ID)
+        presets = _zones(buf, chunks, b"phdr", b"pbag", b"pgen", GEN_INSTRUMENT)
+        shdr_offset, shdr_size = chunks[b"shdr"]
+        samples = []
+        for i in range(shdr_size // SHDR_RECORD.size - 1):
+            _name, start, end = SHDR_RECORD.unpack_from(buf, shdr_offset + i * SHDR_RECORD.size)[:3]
+            samples.append(2 * max(0, end - start))  # 16-bit mono
+        phdr_offset, _ = chunks[b"phdr"]
+        sizes = []
+        for i, inst_ids in enumerate(presets):
+            _name, program, bank = PHDR_RECORD.unpack_from(buf, phdr_offset + i * PHDR_RECORD.size)[:3]
+            sample_ids = {s for inst in inst_ids if inst < len(instruments) for s in instruments[inst]}
+            sizes.append([bank, program, sum(samples[s] for s in sample_ids if s < len(samples))])
+    sizes.sort()
+    return sizes
+
+def presets_used(messages):
+    """
+    Set of (bank, program) pairs that notes are played with in raw MIDI
+    messages, tracking bank select (CC 0) and program changes per channel
+    the same way SoundFontPool does, channel 10 staying on bank 128.
+    """
+    banks = [0] * 16
+    banks[9] = 128
+    programs = [0] * 16
+    counted = [False] * 16   # current preset of the channel is in `used` already
+    used = set()
+    # by index: the messages may be a file mapped from the event cache
+    for i in range(len(messages)):
+        message = messages[i]
+        status = message[0]
+        kind = status & 0xF0
+        if kind == 0x90:
+            channel = status & 0x0F
+            if not counted[channel] and len(message) >= 3 and message[2]:
+                used.add((banks[channel], programs[channel]))
+                counted[channel] = True
+        elif kind == 0xC0 and len(message) >= 2:
+            programs[status & 0x0F] = message[1]
+            counted[status & 0x0F] = False
+        elif kind == 0xB0 and len(message) >= 3 and message[1] == 0 and status & 0x0F != 9:
+            banks[status & 0x0F] = message[2]
+            counted[status & 0x0F] = False
+    return used
+
+class Catalog:
+    """
+    Preset headers and per-preset sample sizes of the installed SoundFonts,
+    cached on disk and keyed by file size and mtime so each .sf2 is parsed once.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()  # one scan at a time: the menu and the control socket both start them
+        self._fonts = {}
+        self._programs = {}
+        self._preset_bytes = {}
+        try:
+            with open(cache_path) as f:
+                self._fonts = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp = self.cache_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._fonts, f)
+            os.replace(tmp, self.cache_path)
+
+    def _entry(self, path):
+        st = os.stat(path)
+        entry = self._fonts.get(path)
+        if entry is None or entry["size"] != st.st_size or entry["mtime"] != st.st_mtime or "preset_bytes" not in entry:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                sample_data = sample_data_size(buf)
+            entry = {"size": st.st_size, "mtime": st.st_mtime, "presets": read_presets(path),
+                     "preset_bytes": read_preset_sizes(path), "sample_data": sample_data}
+            with self._lock:
+                self._fonts[path] = entry
+                self._programs.pop(path, None)
+                self._preset_bytes.pop(path, None)
+            self.save()
+        return entry
+
+    def scan(self, directory):
+        """Catalog every .sf2 below `directory`. Returns the sorted list of paths."""
+        with self._scan_lock:
+            paths = []
+            for dirpath, dirnames, filenames in os.walk(directory):
+                for filename in filenames:
+                    if filename.endswith(".sf2"):
+                        path = dirpath + "/" + filename
+                        try:
+                            self._entry(path)
+                            paths.append(path)
+                        except (OSError, ValueError) as e:
+                            print(f"Skipping SoundFont {path}: {e}")
+            with self._lock:
+                for path in [p for p in self._fonts if p.startswith(directory) and p not in paths]:
+                    del self._fonts[path]
+            return sorted(paths)
+
+    def presets(self, path):
+        return self._entry(path)["presets"]
+
+    def programs(self, path):
+        """Set of (bank, program) pairs available in the SoundFont."""
+        programs = self._programs.get(path)
+        if programs is None:
+            programs = {(bank, program) for bank, program, _name in self.presets(path)}
+            self._programs[path] = programs
+        return programs
+
+    def preset_bytes(self, path):
+        """Dict of (bank, program) -> bytes of sample data the preset uses."""
+        sizes = self._preset_bytes.get(path)
+        if sizes is None:
+            sizes = {(bank, program): size for bank, program, size in self._entry(path)["preset_bytes"]}
+            self._preset_bytes[path] = sizes
+        return sizes
+
+    def header_size(self, path):
+        """Bytes of the SoundFont that are not sample data: what loading it without its samples costs."""
+        entry = self._entry(path)
+        return entry["size"] - entry["sample_data"]
+
+    def first_preset(self, path):
+        presets = self.presets(path)
+        if not presets:
+            return None
+        bank, program, _name = presets[0]
+        return bank, program
+
+    def has_preset(self, path, bank, program):
+        return (bank, program) in self.programs(path)
+
+class SoundFontPool:
+    """
+    Recently used SoundFonts kept loaded in one running synth.
+
+    Switching fonts re-points every channel at the new font instead of
+    rebuilding the synth and audio driver. Fonts are evicted least recently
+    used first once their combined size exceeds `budget` bytes. Program and
+    bank changes go through the pool so they always resolve against the
+    active font, not whichever font happens to be on top of FluidSynth's stack.
+
+    With `dynamic` (the synth must have synth.dynamic-sample-loading on), a
+    font is loaded without its samples, and FluidSynth reads a preset's
+    samples when a channel selects it and frees them when none does.
+    `preload()` loads the presets a file is about to use ahead of time, and
+    every preset that gets played is kept loaded after its channel moves on,
+    by selecting it on one of the synth's channels above 16, which MIDI never
+    plays on. Those count against the budget too, least recently used going
+    first, so only what is played takes memory and large fonts fit.
+    """
+
+    def __init__(self, synth, catalog, budget, dynamic=False):
+        self.synth = synth
+        self.catalog = catalog
+        self.budget = budget
+        self.dynamic = dynamic
+        self.active = None
+        self.sfid = None
+        self.programs = set()
+        self.preset_bytes = {}
+        self._loaded = OrderedDict()   # path -> (sfid, size), least recently used first
+        self._pinned = OrderedDict()   # (bank, program) of the active font -> channel holding it, least recently used first
+        self._spare = list(range(16, synth.get_setting("synth.midi-channels") or 256))
+        self._lock = threading.RLock()
+        self._default_channels()
+
+    def _default_channels(self):
+        self.banks = [0] * 16
+        self.banks[9] = 128  # FluidSynth puts channel 10 on the percussion bank
+        self.channel_programs = [0] * 16
+
+    def loaded(self):
+        return list(self._loaded)
+
+    def used(self):
+        fonts = sum(size for _sfid, size in self._loaded.values())
+        return fonts + sum(self.preset_bytes.get(preset, 0) for preset in self._pinned)
+
+    def select(self, path):
+        """Make `path` the active font, loading it if it isn't resident yet."""
+        with self._lock:
+            self._unpin_all()  # pins hold presets of the font that was active
+            if path in self._loaded:
+                self._loaded.move_to_end(path)
+                sfid = self._loaded[path][0]
+            else:
+                size = self.catalog.header_size(path) if self.dynamic else os.path.getsize(path)
+                self._evict(size)
+                sfid = self.synth.sfload(path, False)
+                if sfid < 0:
+                    raise ValueError(f"Could not load SoundFont {path}")
+                self._loaded[path] = (sfid, size)
+            self.active = path
+            self.sfid = sfid
+            self.programs = self.catalog.programs(path)
+            self.preset_bytes = self.catalog.preset_bytes(path) if self.dynamic else {}
+            self.apply()
+
+    def _evict(self, incoming):
+        while self._loaded and self.used() + incoming > self.budget:
+            path, (sfid, _size) = self._loaded.popitem(last=False)
+            print(f"Unloading SoundFont {path}")
+            self.synth.sfunload(sfid, False)
+
+    def preload(self, presets):
+        """Load the samples of `presets`, (bank, program) pairs of the active font, before they are played."""
+        if not self.dynamic:
+            return
+        with self._lock:
+            for bank, program in presets:
+                if (bank, program) in self.programs:
+                    self._pin(bank, program)
+
+    def _pin(self, bank, program):
+        preset = (bank, program)
+        if preset in self._pinned:
+            self._pinned.move_to_end(preset)
+            return
+        size = self.preset_bytes.get(preset, 0)
+        while self._pinned and (self.used() + size > self.budget or not self._spare):
+            self._unpin(next(iter(self._pinned)))
+        if not self._spare:
+            return
+        channel = self._spare.pop()
+        self._pinned[preset] = channel
+        self.synth.program_select(channel, self.sfid, bank, program)
+
+    def _unpin(self, preset):
+        channel = self._pinned.pop(preset)
+        self.synth.program_unset(channel)  # samples are freed unless a MIDI channel still plays the preset
+        self._spare.append(channel)
+
+    def _unpin_all(self):
+        for preset in list(self._pinned):
+            self._unpin(preset)
+
+    def apply(self):
+        """Select the active font on every channel, keeping bank and program where it can."""
+        for channel in range(16):
+            self.program_select(channel, self.banks[channel], self.channel_programs[channel])
+
+    def program_select(self, channel, bank, program):
+        # remember what was asked for, so switching back to a font that has it restores it
+        self.banks[channel] = bank
+        self.channel_programs[channel] = program
+        if (bank, program) not in self.programs:
+            # fall back to the first preset of the bank, then of the font
+            candidates = sorted(p for b, p in self.programs if b == bank)
+            if candidates:
+                program = candidates[0]
+            elif self.programs:
+                bank, program = min(self.programs)
+            else:
+                return False
+        self.synth.program_select(channel, self.sfid, bank, program)
+        if self.dynamic:
+            with self._lock:
+                self._pin(bank, program)
+        return True
+
+    def program_change(self, channel, program):
+        # ignore programs the SoundFont doesn't have instead of going silent
+        if (self.banks[channel], program) in self.programs:
+            self.channel_programs[channel] = program
+            # with dynamic loading this reads the samples now, unless the preset was preloaded
+            self.synth.program_select(channel, self.sfid, self.banks[channel], program)
+            if self.dynamic:
+                with self._lock:
+                    self._pin(self.banks[channel], program)
+
+    def bank_select(self, channel, bank):
+        # like FluidSynth, channel 10 stays on the percussion bank whatever CC 0 says
+        if channel != 9:
+            self.banks[channel] = bank
+
+    def select_first_preset(self, channel=0):
+        preset = self.catalog.first_preset(self.active)
+        if preset is None:
+            raise ValueError("No presets found in the SoundFont")
+        bank, program = preset
+        self.program_select(channel, bank, program)
+        print(f"Selected Bank {bank}, Preset {program}")
+
+    def reset(self):
+        """Silence everything and restore default channel state, keeping fonts loaded."""
+        with self._lock:
+            for channel in range(16):
+                self.synth.cc(channel, 120, 0)  # all sound off
+                self.synth.cc(channel, 121, 0)  # reset all controllers
+                self.synth.pitch_bend(channel, 0)
+            self._default_channels()
+            self.apply()
@@ -0,0 +1,107 @@
+import queue, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class Dispatcher:
+    """
+    Single UI thread plus a small worker pool.
+
+    Everything that reads or changes menu state runs on the dispatcher thread,
+    in the order it was posted: button presses, device and library
+    notifications, and the completion of background jobs. Slow work
+    (Bluetooth, SoundFont loading) goes to the pool with `submit()`, and its
+    result comes back to the dispatcher thread, so handlers never block and
+    never race each other.
+    """
+
+    def __init__(self, workers=2):
+        self.busy = None          # label of the job that is running, if any
+        self.progress = None      # latest progress text of that job
+        self.on_update = None     # called on the dispatcher thread when busy/progress change
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._deferred = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ui", daemon=True)
+        self._thread.start()
+
+    def post(self, fn, *args):
+        """Run `fn(*args)` on the dispatcher thread. Safe to call from any thread."""
+        self._queue.put((fn, args))
+
+    def call(self, fn, *args):
+        """
+        Run `fn(*args)` on the dispatcher thread. Returns a Future of its
+        result, for callers on other threads that need it but must not wait.
+        """
+        future = Future()
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+        self.post(run)
+        return future
+
+    def run_in_pool(self, fn, *args):
+        """Run `fn(*args)` on the worker pool, without a progress label. Returns its Future."""
+        return self._pool.submit(fn, *args)
+
+    def defer(self, fn, *args):
+        """Run `fn(*args)` once the current job is done; a newer call replaces an older one."""
+        self._deferred = (fn, args)
+
+    def submit(self, label, job, done=None):
+        """
+        Run `job(report)` on the worker pool. `report(text)` updates the
+        progress text from the job; `done(result, error)` is then posted back to
+        the dispatcher thread.
+        """
+        self.busy = label
+        self.progress = label
+        if self.on_update is not None:
+            self.on_update()
+        future = self._pool.submit(job, self._report)
+        future.add_done_callback(lambda f: self.post(self._finish, f, done))
+
+    def _report(self, text):
+        self.post(self._set_progress, text)
+
+    def _set_progress(self, text):
+        if self.busy is not None:
+            self.progress = text
+            if self.on_update is not None:
+                self.on_update()
+
+    def _finish(self, future, done):
+        self.busy = None
+        self.progress = None
+        error = future.exception()
+        if error is not None:
+            print("Job failed:", error)
+        if done is not None:
+            done(None if error is not None else future.result(), error)
+        if self.on_update is not None:
+            self.on_update()
+        deferred, self._deferred = self._deferred, None
+        if deferred is not None:
+            fn, args = deferred
+            fn(*args)
+
+    def _run(self):
+        while True:
+            fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Error in {getattr(fn, '__name__', fn)}: {e}")
+
+    def wait_idle(self, timeout=None):
+        """Block until the queue is drained and no job is running (for scripts and tests)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.busy is not None or not self._queue.empty():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True